@@ -87,6 +87,13 @@ def generate_initial_state():
 
     print(f"All Parquet files uploaded to S3 bucket '{bucket_name}' and local files deleted.")
 
+    # The modules rebuild the ID registry from the new Parquet files on first start
+    try:
+        s3.delete_object(Bucket=bucket_name, Key='id_registry.json')
+        print("Removed stale ID registry: id_registry.json")
+    except Exception as e:
+        print(f"Error removing stale ID registry: {e}")
+
     print("S3 Links to Parquet files:")
     print(json.dumps(s3_links, indent=4))
 
@@ -168,6 +168,11 @@ resource "aws_sqs_queue" "fifo_queue" {
   content_based_deduplication = true
 }
 
+# Fired scheduled events, consumed only by the traffic module
+resource "aws_sqs_queue" "traffic_control_events_queue" {
+  name = "TrafficControlEvents"
+}
+
 # Create ECR repositories for each service
 resource "aws_ecr_repository" "simcore_repo" {
   name = "simcore"
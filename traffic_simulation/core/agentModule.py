@@ -1,27 +1,37 @@
 import json
-import os
 import time
-import pandas as pd
-import boto3
-from traffic_simulation.utils import sqsUtility
+import numpy as np
+from traffic_simulation.utils import configUtility, sqsUtility, storageUtility, idRegistry
+from traffic_simulation.utils.profilingUtility import TickProfiler
+from traffic_simulation.core.vehiclePool import VehiclePool
+from traffic_simulation.core.odDemand import ODDemand
 
 class AgentModule:
-    def __init__(self):
-        self.vehicles = {}  # Stores vehicles with their positions and states
+    def __init__(self, config=None):
+        self.pool = None  # Preallocated vehicle storage, created once the road table is known
+        self.demand = None  # OD demand generator, if enabled
         self.initialized = False
 
-        # Load configuration
-        config_file = os.path.join(os.path.dirname(__file__), 'config.json')
-        with open(config_file, 'r') as config_file:
-            CONFIG = json.load(config_file)
-            QUEUES = CONFIG.get('AGENT_MOD_QUEUES', ['SimulationEvents', 'SimCoreUpdates'])
-            self.MAX_NUMBER_OF_MESSAGES = CONFIG.get('MAX_NUMBER_OF_MESSAGES', 10)
-            self.WAIT_TIME_SECONDS = CONFIG.get('WAIT_TIME_SECONDS', 1)
-            self.S3_LINKS = CONFIG.get('S3_LINKS', {})
+        # Shared configuration, unless one is passed in (e.g. by the sweep runner)
+        CONFIG = config if config is not None else configUtility.get_config()
+        QUEUES = CONFIG.get('AGENT_MOD_QUEUES', ['SimulationEvents', 'SimCoreUpdates'])
+        self.MAX_NUMBER_OF_MESSAGES = CONFIG.get('MAX_NUMBER_OF_MESSAGES', 10)
+        self.WAIT_TIME_SECONDS = CONFIG.get('WAIT_TIME_SECONDS', 1)
+        self.S3_LINKS = CONFIG.get('S3_LINKS', {})
+        self.PROFILING = CONFIG.get('PROFILING', {})
+        self.ID_REGISTRY_KEY = CONFIG.get('ID_REGISTRY_KEY', 'id_registry.json')
+        self.VEHICLE_POOL_SIZE = CONFIG.get('VEHICLE_POOL_SIZE', 100000)
+        self.SPEED_SCALE = CONFIG.get('SPEED_SCALE', 0.01)  # Road length units moved per tick per unit of speed
+        self.DEMAND = CONFIG.get('DEMAND', {})
 
         self.queue_urls = sqsUtility.get_queue_urls(QUEUES)
-        # AWS S3 client
-        self.s3_client = boto3.client('s3')
+        self.storage = storageUtility.get_storage(CONFIG)
+        self.registry = None  # Shared string ID <-> int index registry, loaded with the initial state
+        self.profiler = TickProfiler.from_config('AgentModule', self.storage, self.PROFILING)
+
+        # Road table (parallel arrays indexed by registry road index)
+        self.road_lengths = np.empty(0, dtype=float)
+        self.next_vehicle_number = 0
 
     def process_messages(self):
         try:
@@ -30,7 +40,13 @@ class AgentModule:
                 event = json.loads(message['Body'])
                 event_type = event.get('type')
                 if event_type == 'SimulationTick' and self.initialized:
-                    self.process_tick(event['data'])
+                    if self.profiler.active:
+                        self.profiler.run_tick(self.process_tick, event['data'])
+                    else:
+                        self.process_tick(event['data'])
+                elif event_type == 'ProfileControl':
+                    if not self.profiler.handle_control(event.get('data', {})):
+                        continue
                 else:
                     print(f"(AgentModule) Unhandled event type: {event_type}")
 
@@ -40,54 +56,127 @@ class AgentModule:
             print(f"(AgentModule) Error processing messages: {e}")
 
     def load_initial_state(self):
-        """Download Parquet files from S3 and initialize vehicles."""
+        """Read Parquet files from storage and initialize vehicles."""
         try:
+            # Vehicles, roads and intersections are referred to by registry indices from here on
+            registry = idRegistry.load_registry(self.storage, self.S3_LINKS, self.ID_REGISTRY_KEY)
+
+            roads_df = None
+            roads_s3_url = self.S3_LINKS.get('roads')
+            if roads_s3_url:
+                print(f"Loading roads data from {roads_s3_url}")
+                roads_df = storageUtility.read_parquet(self.storage, self.storage.key_from_link(roads_s3_url))
+
+            vehicles_df = None
             vehicles_s3_url = self.S3_LINKS.get('vehicles')
             if vehicles_s3_url:
-                print(f"Downloading vehicles data from {vehicles_s3_url}")
-                # Parse the S3 URL
-                bucket_name, key = self.parse_s3_url(vehicles_s3_url)
-                # Download the Parquet file
-                self.s3_client.download_file(bucket_name, key, 'vehicles.parquet')
-                # Load the Parquet file into a DataFrame
-                vehicles_df = pd.read_parquet('vehicles.parquet')
-                # Convert DataFrame to dictionary
-                self.vehicles = vehicles_df.set_index('vehicle_id').to_dict(orient='index')
-                print(f"Loaded {len(self.vehicles)} vehicles.")
-                self.initialized = True
+                print(f"Loading vehicles data from {vehicles_s3_url}")
+                # Load the Parquet object into a DataFrame
+                vehicles_df = storageUtility.read_parquet(self.storage, self.storage.key_from_link(vehicles_s3_url))
             else:
                 print("No vehicles S3 link provided.")
-                self.initialized = False
+
+            self.setup(registry, roads_df, vehicles_df)
         except Exception as e:
             print(f"(AgentModule) Error loading initial state: {e}")
             self.initialized = False  # Ensure initialized remains False on error
 
-    def parse_s3_url(self, s3_url):
-        """Parse S3 URL to extract bucket name and key."""
-        s3_url = s3_url.replace("s3://", "")
-        bucket_name, key = s3_url.split('/', 1)
-        return bucket_name, key
+    def setup(self, registry, roads_df, vehicles_df):
+        """Build the road table, vehicle pool and OD demand from already-loaded scenario data."""
+        self.registry = registry
+        self.next_vehicle_number = self.registry.count('vehicle')  # Spawned vehicles come after the scenario's
+
+        self.build_road_table(roads_df)
+        self.pool = VehiclePool(self.VEHICLE_POOL_SIZE)
+
+        if vehicles_df is not None:
+            self.load_vehicles(vehicles_df)
+            print(f"Loaded {len(self.pool)} vehicles.")
+
+        if self.DEMAND.get('enabled') and roads_df is not None:
+            self.demand = ODDemand(
+                self.registry.indices['intersection'],
+                self.road_start,
+                self.road_end,
+                self.DEMAND.get('od_matrix', {}),
+                profile=self.DEMAND.get('profile'),
+                profile_step_ticks=self.DEMAND.get('profile_step_ticks', 1),
+                seed=self.DEMAND.get('seed')
+            )
+            print(f"OD demand enabled for {len(self.demand.pair_rates)} origin-destination pairs.")
+
+        self.initialized = vehicles_df is not None or self.demand is not None
+
+    def build_road_table(self, roads_df):
+        """Lay out road lengths and endpoints by registry index for the vectorized tick."""
+        n_roads = self.registry.count('road')
+        # Roads without geometry (only referenced by vehicles) never end and are never routed through
+        self.road_lengths = np.full(n_roads, np.inf)
+        self.road_start = np.full(n_roads, -1, dtype=np.int32)
+        self.road_end = np.full(n_roads, -1, dtype=np.int32)
+
+        if roads_df is not None:
+            # Strict: an unknown ID would index -1 and silently overwrite the last road
+            roads = self.registry.encode('road', roads_df['road_id'], strict=True)
+            self.road_lengths[roads] = roads_df['length'].to_numpy(dtype=float)
+            self.road_start[roads] = self.registry.encode('intersection', roads_df['start'], strict=True)
+            self.road_end[roads] = self.registry.encode('intersection', roads_df['end'], strict=True)
+
+    def load_vehicles(self, vehicles_df):
+        """Place the scenario's initial vehicles into the pool as free-roaming vehicles."""
+        count = len(vehicles_df)
+        self.pool.spawn(
+            self.registry.encode('vehicle', vehicles_df['vehicle_id'], strict=True),
+            self.registry.encode('road', vehicles_df['road'], strict=True),
+            vehicles_df['position'].fillna(0).to_numpy(dtype=float) if 'position' in vehicles_df else np.zeros(count),
+            vehicles_df['speed'].fillna(20).to_numpy(dtype=float) if 'speed' in vehicles_df else np.full(count, 20.0),
+            np.full(count, -1, dtype=np.int32)
+        )
+
+    def spawn_vehicles(self, tick_number):
+        """Sample this tick's OD arrivals and place them at the start of their first road."""
+        first_road, destinations = self.demand.sample(tick_number)
+        count = len(first_road)
+        if not count:
+            return
+
+        vehicle_ids = np.arange(self.next_vehicle_number, self.next_vehicle_number + count, dtype=np.int32)
+        slots = self.pool.spawn(
+            vehicle_ids,
+            first_road,
+            np.zeros(count),
+            np.full(count, float(self.DEMAND.get('speed', 20))),
+            destinations
+        )
+        self.next_vehicle_number += len(slots)
+        if len(slots) < count:
+            print(f"(AgentModule) Vehicle pool full, dropped {count - len(slots)} arrivals")
+
+    def route_vehicles(self, slots):
+        """Move OD vehicles that reached the end of their road onto the next one, or despawn them."""
+        pool = self.pool
+        routed = slots[pool.destination[slots] >= 0]
+        at_end = routed[pool.position[routed] >= self.road_lengths[pool.road[routed]]]
+        if not len(at_end):
+            return []
+
+        next_road, arrived = self.demand.route(pool.road[at_end], pool.destination[at_end])
+        continuing = at_end[~arrived]
+        pool.position[continuing] -= self.road_lengths[pool.road[continuing]]
+        pool.road[continuing] = next_road[~arrived]
+
+        finished = at_end[arrived]
+        despawned_ids = pool.vehicle_ids[finished].tolist()
+        pool.despawn(finished)
+        return despawned_ids
 
     def process_tick(self, tick_data):
         """Update vehicle positions based on the tick event and send updates to SimCore."""
         try:
-            batch_updates = []
-            for vehicle_id, vehicle in self.vehicles.items():
-                # Update vehicle position
-                current_position = vehicle.get('position', 0)
-                speed = vehicle.get('speed', 20)
-                # Simple movement logic
-                new_position = current_position + speed * 0.01  # Adjust as needed
-                vehicle['position'] = new_position
-                # Prepare update message
-                batch_updates.append({
-                    'type': 'VehicleMoved',
-                    'data': {
-                        'vehicle_id': vehicle_id,
-                        'road': vehicle.get('road', 'unknown'),
-                        'position_on_road': new_position
-                    }
-                })
+            if tick_data.get('id_registry_version', self.registry.version) != self.registry.version:
+                print(f"(AgentModule) ID registry mismatch: SimCore has {tick_data['id_registry_version']}, we have {self.registry.version}")
+
+            batch_updates = self.step(tick_data['tick_number'])
 
             # Send batch updates to SimCoreUpdates queue
             sqsUtility.send_batch_messages(self.queue_urls['SimCoreUpdates'], batch_updates)
@@ -95,13 +184,56 @@ class AgentModule:
         except Exception as e:
             print(f"(AgentModule) Error processing tick: {e}")
 
+    def step(self, tick_number):
+        """Advance every vehicle by one tick and return the resulting update messages."""
+        pool = self.pool
+        if self.demand:
+            self.spawn_vehicles(tick_number)
+
+        # Simple movement logic, applied to every active vehicle at once
+        slots = pool.active_slots()
+        pool.position[slots] += pool.speed[slots] * self.SPEED_SCALE
+
+        despawned_ids = []
+        if self.demand:
+            despawned_ids = self.route_vehicles(slots)
+            slots = slots[pool.active[slots]]
+
+        # Prepare update messages
+        batch_updates = [
+            {
+                'type': 'VehicleMoved',
+                'data': {
+                    'vehicle_id': vehicle_id,
+                    'road': road,
+                    'position_on_road': position,
+                    'speed': speed
+                }
+            }
+            for vehicle_id, road, position, speed in zip(
+                pool.vehicle_ids[slots].tolist(),
+                pool.road[slots].tolist(),
+                pool.position[slots].tolist(),
+                pool.speed[slots].tolist()
+            )
+        ]
+        batch_updates.extend(
+            {'type': 'VehicleDespawned', 'data': {'vehicle_id': vehicle_id}}
+            for vehicle_id in despawned_ids
+        )
+        return batch_updates
+
 if __name__ == "__main__":
     print("Starting AgentModule...")
 
-    agent_module = AgentModule()
+    with configUtility.startup_phase('AgentModule init'):
+        agent_module = AgentModule()
+    agent_module.profiler.install_signal_handlers(agent_module.PROFILING.get('signal_ticks', 10))
 
     # Load initial state
-    agent_module.load_initial_state()
+    with configUtility.startup_phase('load initial state'):
+        agent_module.load_initial_state()
+    configUtility.print_startup_report('AgentModule')
 
     if agent_module.initialized:
         try:
@@ -0,0 +1,52 @@
+import heapq
+import itertools
+
+class EventScheduler:
+    """
+    Priority queue of future-dated simulation events.
+
+    Events are ordered by simulation time (in ticks, fractional values allowed)
+    and fired in exact time order. An optional key lets a newer event supersede
+    a pending one for the same entity (e.g. a rescheduled light phase); the
+    superseded entry is skipped lazily when it reaches the top of the heap.
+    """
+
+    def __init__(self):
+        self.heap = []
+        self.counter = itertools.count()  # Tie-breaker keeps FIFO order for equal times
+        self.pending_keys = {}  # key -> sequence number of the live entry
+        self.live_count = 0
+
+    def __len__(self):
+        return self.live_count
+
+    def schedule(self, time, event, key=None):
+        """Schedule an event to fire at the given simulation time."""
+        seq = next(self.counter)
+        heapq.heappush(self.heap, (time, seq, key, event))
+        if key is None or key not in self.pending_keys:
+            self.live_count += 1
+        if key is not None:
+            self.pending_keys[key] = seq
+
+    def pop_due(self, now):
+        """Pop all live events with time <= now, in time order, as (time, event) pairs."""
+        due = []
+        while True:
+            self._discard_stale()
+            if not self.heap or self.heap[0][0] > now:
+                break
+            time, seq, key, event = heapq.heappop(self.heap)
+            if key is not None:
+                del self.pending_keys[key]
+            self.live_count -= 1
+            due.append((time, event))
+        return due
+
+    def _discard_stale(self):
+        # Drop superseded entries sitting at the top of the heap
+        while self.heap:
+            _, seq, key, _ = self.heap[0]
+            if key is None or self.pending_keys.get(key) == seq:
+                return
+            heapq.heappop(self.heap)
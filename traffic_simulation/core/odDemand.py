@@ -0,0 +1,84 @@
+from collections import deque
+import numpy as np
+
+class ODDemand:
+    """
+    Origin-destination demand generator over the road network.
+
+    od_matrix maps origin intersection -> {destination intersection: vehicles per tick}.
+    Arrivals for every OD pair are drawn in one vectorized Poisson sample per tick,
+    scaled by a cyclic time-of-day profile. Routing uses a next-hop table built once
+    per destination (shortest path in road count over the directed roads).
+    """
+
+    def __init__(self, node_index, road_start, road_end, od_matrix, profile=None, profile_step_ticks=1, seed=None):
+        self.node_index = node_index
+        self.road_start = road_start
+        self.road_end = road_end
+        self.profile = np.asarray(profile or [1.0], dtype=float)
+        self.profile_step_ticks = max(1, profile_step_ticks)
+        self.rng = np.random.default_rng(seed)
+
+        # Flatten the OD matrix into parallel arrays over known intersections
+        origins, destinations, rates = [], [], []
+        for origin, row in od_matrix.items():
+            for destination, rate in row.items():
+                if origin in node_index and destination in node_index and origin != destination:
+                    origins.append(node_index[origin])
+                    destinations.append(node_index[destination])
+                    rates.append(rate)
+
+        # Destination nodes get dense indices for the next-hop table rows
+        self.destination_nodes = np.array(sorted(set(destinations)), dtype=np.int32)
+        destination_rows = {node: k for k, node in enumerate(self.destination_nodes)}
+        self.pair_origins = np.array(origins, dtype=np.int32)
+        self.pair_destinations = np.array([destination_rows[d] for d in destinations], dtype=np.int32)
+        self.pair_rates = np.array(rates, dtype=float)
+
+        self.next_hop = self.build_next_hop(len(node_index))
+
+    def build_next_hop(self, n_nodes):
+        """next_hop[k, node] is the road to take from node towards destination k (-1 if none)."""
+        incoming = [[] for _ in range(n_nodes)]
+        for road_idx, end in enumerate(self.road_end):
+            if end >= 0 and self.road_start[road_idx] >= 0:
+                incoming[end].append(road_idx)
+
+        next_hop = np.full((len(self.destination_nodes), n_nodes), -1, dtype=np.int32)
+        for k, destination in enumerate(self.destination_nodes):
+            # Backward BFS from the destination over directed roads
+            visited = {int(destination)}
+            queue = deque([int(destination)])
+            while queue:
+                node = queue.popleft()
+                for road_idx in incoming[node]:
+                    upstream = int(self.road_start[road_idx])
+                    if upstream not in visited:
+                        visited.add(upstream)
+                        next_hop[k, upstream] = road_idx
+                        queue.append(upstream)
+        return next_hop
+
+    def sample(self, tick_number):
+        """Return (first_road, destination) arrays for the vehicles arriving this tick."""
+        if not len(self.pair_rates):
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+
+        multiplier = self.profile[(tick_number // self.profile_step_ticks) % len(self.profile)]
+        counts = self.rng.poisson(self.pair_rates * multiplier)
+        origins = np.repeat(self.pair_origins, counts)
+        destinations = np.repeat(self.pair_destinations, counts)
+
+        # Drop arrivals whose destination is unreachable from their origin
+        first_road = self.next_hop[destinations, origins]
+        routable = first_road >= 0
+        return first_road[routable], destinations[routable]
+
+    def route(self, roads, destinations):
+        """For vehicles at the end of roads, return (next_road, arrived) arrays."""
+        end_nodes = self.road_end[roads]
+        arrived = end_nodes == self.destination_nodes[destinations]
+        next_road = self.next_hop[destinations, end_nodes]
+        # A dead end (no route onward) also takes the vehicle out of the network
+        arrived |= next_road < 0
+        return next_road, arrived
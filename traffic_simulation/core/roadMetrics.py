@@ -0,0 +1,133 @@
+import numpy as np
+from traffic_simulation.utils import configUtility, storageUtility
+
+pd = configUtility.lazy_import('pandas')  # Only needed when flushing
+
+class RoadMetrics:
+    """
+    Per-road traffic metrics computed incrementally from applied vehicle updates.
+
+    Running sums are kept per road (vehicle count, speed sum, exits) and adjusted
+    only for the vehicles that move, so closing a tick never rescans the fleet.
+    Closed ticks are buffered as column blocks and flushed to Parquet files
+    partitioned by time window (<prefix>/window=<n>/part-<tick>.parquet) on the
+    storage backend.
+    """
+
+    def __init__(self, roads, storage, registry, metrics_prefix='metrics', window_ticks=60, flush_rows=100000, vehicle_length=0.005):
+        self.storage = storage
+        self.metrics_prefix = metrics_prefix
+        self.window_ticks = max(1, window_ticks)
+        self.flush_rows = max(1, flush_rows)
+        self.vehicle_length = vehicle_length
+
+        # Dense road indices so the running sums can live in flat arrays
+        self.road_ids = np.array(list(roads.keys()), dtype=object)
+        self.road_index = {road_id: i for i, road_id in enumerate(self.road_ids)}
+        self.road_lengths = np.array([roads[r].get('length', 0) or 0 for r in self.road_ids], dtype=float)
+        # String road IDs are only needed for the Parquet output
+        self.road_names = np.array([registry.name('road', r) for r in self.road_ids], dtype=object)
+
+        n_roads = len(self.road_ids)
+        self.vehicle_counts = np.zeros(n_roads, dtype=np.int64)
+        self.speed_sums = np.zeros(n_roads, dtype=float)
+        self.exits = np.zeros(n_roads, dtype=np.int64)  # Reset at every tick
+
+        # Last applied (road index, speed, position) per vehicle
+        self.vehicles = {}
+
+        # Buffered column blocks for the current window
+        self.blocks = []
+        self.buffered_rows = 0
+        self.buffer_window = None
+
+    def record_vehicle(self, vehicle_id, road, position, speed=None):
+        """Apply one vehicle update to the running sums."""
+        road_idx = self.road_index.get(road)
+        previous = self.vehicles.get(vehicle_id)
+
+        if speed is None:
+            # Fall back to the displacement since the last update on the same road
+            if previous is not None and previous[0] == road_idx:
+                speed = position - previous[2]
+            else:
+                speed = 0.0
+
+        if previous is not None:
+            prev_idx, prev_speed, _ = previous
+            if prev_idx is not None:
+                self.vehicle_counts[prev_idx] -= 1
+                self.speed_sums[prev_idx] -= prev_speed
+                if prev_idx != road_idx:
+                    self.exits[prev_idx] += 1
+
+        if road_idx is not None:
+            self.vehicle_counts[road_idx] += 1
+            self.speed_sums[road_idx] += speed
+
+        self.vehicles[vehicle_id] = (road_idx, speed, position)
+
+    def remove_vehicle(self, vehicle_id):
+        """Drop a vehicle from the running sums, counting it as leaving its road."""
+        previous = self.vehicles.pop(vehicle_id, None)
+        if previous is not None and previous[0] is not None:
+            self.vehicle_counts[previous[0]] -= 1
+            self.speed_sums[previous[0]] -= previous[1]
+            self.exits[previous[0]] += 1
+
+    def end_tick(self, tick_number):
+        """Snapshot the running sums for this tick into the buffer, flushing as needed."""
+        window = tick_number // self.window_ticks
+        if self.buffer_window is not None and window != self.buffer_window:
+            self.flush()
+        self.buffer_window = window
+
+        block = self.close_tick(tick_number)
+        self.blocks.append(block)
+        self.buffered_rows += len(block['tick_number'])
+
+        if self.buffered_rows >= self.flush_rows:
+            self.flush()
+
+    def close_tick(self, tick_number):
+        """Compute this tick's per-road columns from the running sums and reset the per-tick exits."""
+        counts = self.vehicle_counts.astype(float)
+        occupied = counts > 0
+        has_length = self.road_lengths > 0
+
+        avg_speed = np.zeros_like(counts)
+        np.divide(self.speed_sums, counts, out=avg_speed, where=occupied)
+        density = np.zeros_like(counts)
+        np.divide(counts, self.road_lengths, out=density, where=has_length)
+        occupancy = np.minimum(density * self.vehicle_length, 1.0)
+
+        block = {
+            'tick_number': np.full(len(counts), tick_number, dtype=np.int64),
+            'road_id': self.road_names,
+            'vehicle_count': self.vehicle_counts.copy(),
+            'avg_speed': avg_speed,
+            'density': density,
+            'occupancy': occupancy,
+            'throughput': self.exits.copy()
+        }
+        self.exits[:] = 0
+        return block
+
+    def flush(self):
+        """Write the buffered ticks as one Parquet part file in their window partition."""
+        if not self.blocks:
+            return
+        try:
+            columns = {name: np.concatenate([block[name] for block in self.blocks]) for name in self.blocks[0]}
+            metrics_df = pd.DataFrame(columns)
+
+            first_tick = int(columns['tick_number'][0])
+            key = f"{self.metrics_prefix}/window={self.buffer_window}/part-{first_tick:010d}.parquet"
+            storageUtility.write_parquet(self.storage, key, metrics_df)
+            print(f"Flushed {len(metrics_df)} road metric rows to {key}")
+        except Exception as e:
+            print(f"Error flushing road metrics: {e}")
+        finally:
+            # Drop the buffer even on failure so memory stays bounded
+            self.blocks = []
+            self.buffered_rows = 0
@@ -1,35 +1,104 @@
-import os
 import time
 import json
-import boto3
-import pandas as pd
-from traffic_simulation.utils import sqsUtility
+import math
+from traffic_simulation.utils import configUtility, sqsUtility, storageUtility, idRegistry
+from traffic_simulation.utils.profilingUtility import TickProfiler
+from traffic_simulation.core.roadMetrics import RoadMetrics
+from traffic_simulation.core.eventScheduler import EventScheduler
+from traffic_simulation.core.trajectoryRecorder import TrajectoryRecorder
+from traffic_simulation.core.stateExporter import StateExporter, DYNAMIC_CATEGORIES, REMOVED
+
+# Event types that SimCore applies to its own state when they fire from the scheduler
+STATE_EVENT_TYPES = ('VehicleMoved', 'VehicleDespawned', 'TRAFFIC_LIGHT_CHANGE', 'ROAD_BLOCKAGE')
 
 class SimCore:
     def __init__(self):
         # Load configuration
-        config_file = os.path.join(os.path.dirname(__file__), 'config.json')
-        with open(config_file, 'r') as config_file:
-            CONFIG = json.load(config_file)
-            self.QUEUES = CONFIG['QUEUES']
-            self.SIMCORE_QUEUE = CONFIG.get('SIMCORE_QUEUE', 'SimulationEvents')
-            self.SIMCORE_UPDATES_QUEUE = CONFIG.get('SIMCORE_UPDATES_QUEUE', 'SimCoreUpdates')
-            self.MAX_NUMBER_OF_MESSAGES = CONFIG.get('MAX_NUMBER_OF_MESSAGES', 10)
-            self.WAIT_TIME_SECONDS = CONFIG.get('WAIT_TIME_SECONDS', 1)
-            self.TICK_INTERVAL = CONFIG.get('TICK_INTERVAL', 1)  # Time between ticks
-            self.S3_LINKS = CONFIG.get('S3_LINKS', {})
-            self.S3_BUCKET = CONFIG.get('S3_BUCKET', None)  # Add this line
-            self.SIM_STATE_S3_KEY = CONFIG.get('SIM_STATE_S3_KEY', 'sim_state.json')  # Add this line
+        CONFIG = configUtility.get_config()
+        self.QUEUES = CONFIG['QUEUES']
+        self.SIMCORE_QUEUE = CONFIG.get('SIMCORE_QUEUE', 'SimulationEvents')
+        self.SIMCORE_UPDATES_QUEUE = CONFIG.get('SIMCORE_UPDATES_QUEUE', 'SimCoreUpdates')
+        self.SCHEDULED_EVENTS_QUEUE = CONFIG.get('SCHEDULED_EVENTS_QUEUE', 'TrafficControlEvents')  # Read only by TrafficControlModule
+        self.MAX_NUMBER_OF_MESSAGES = CONFIG.get('MAX_NUMBER_OF_MESSAGES', 10)
+        self.WAIT_TIME_SECONDS = CONFIG.get('WAIT_TIME_SECONDS', 1)
+        self.TICK_INTERVAL = CONFIG.get('TICK_INTERVAL', 1)  # Time between ticks
+        self.S3_LINKS = CONFIG.get('S3_LINKS', {})
+        self.S3_BUCKET = CONFIG.get('S3_BUCKET', None)  # Add this line
+        self.SIM_STATE_S3_KEY = CONFIG.get('SIM_STATE_S3_KEY', 'sim_state.json')  # Add this line
+        self.ID_REGISTRY_KEY = CONFIG.get('ID_REGISTRY_KEY', 'id_registry.json')
+        self.EXPORT_EVERY_TICKS = CONFIG.get('EXPORT_EVERY_TICKS', 10)
+        self.METRICS_ENABLED = CONFIG.get('METRICS_ENABLED', True)
+        self.METRICS_DIR = CONFIG.get('METRICS_DIR', 'metrics')
+        self.METRICS_WINDOW_TICKS = CONFIG.get('METRICS_WINDOW_TICKS', 60)  # Ticks per Parquet partition
+        self.METRICS_FLUSH_ROWS = CONFIG.get('METRICS_FLUSH_ROWS', 100000)  # Max buffered rows before flushing
+        self.VEHICLE_LENGTH = CONFIG.get('VEHICLE_LENGTH', 0.005)  # In road length units, for occupancy
+        self.RECORDER_ENABLED = CONFIG.get('RECORDER_ENABLED', True)
+        self.RECORDER_DIR = CONFIG.get('RECORDER_DIR', 'trajectories')
+        self.RECORDER_MAX_PENDING_TICKS = CONFIG.get('RECORDER_MAX_PENDING_TICKS', 600)  # Unspilled ticks held while the disk is failing
+        self.RECORDER_SPILL_TICKS = CONFIG.get('RECORDER_SPILL_TICKS', 10)  # Ticks per append to disk
+        self.PROFILING = CONFIG.get('PROFILING', {})
 
         # Initialize SQS client
         self.queue_urls = sqsUtility.get_queue_urls(self.QUEUES)
 
-        # AWS S3 client
-        self.s3_client = boto3.client('s3')
+        # Object storage backend (S3, local filesystem or in-memory, per config)
+        self.storage = storageUtility.get_storage(CONFIG)
+
+        # Shared string ID <-> int index registry; state and messages use the indices
+        self.registry = idRegistry.load_registry(self.storage, self.S3_LINKS, self.ID_REGISTRY_KEY)
 
         # Initialize the simulation state
         self.state = self.load_initial_state()
 
+        # Heading of every road in degrees (counterclockwise from +x), exported with each vehicle
+        self.road_headings = {
+            road_id: math.degrees(math.atan2(road['end_y'] - road['start_y'], road['end_x'] - road['start_x']))
+            for road_id, road in self.state['roads'].items()
+            if all(k in road for k in ('start_x', 'start_y', 'end_x', 'end_y'))
+        }
+
+        # Per-road metrics stage, fed from applied vehicle updates
+        self.metrics = None
+        if self.METRICS_ENABLED:
+            self.metrics = RoadMetrics(
+                self.state['roads'],
+                self.storage,
+                self.registry,
+                metrics_prefix=self.METRICS_DIR,
+                window_ticks=self.METRICS_WINDOW_TICKS,
+                flush_rows=self.METRICS_FLUSH_ROWS,
+                vehicle_length=self.VEHICLE_LENGTH
+            )
+
+        # Trajectory history: in-memory ring buffer spilling to columnar files for replay
+        self.recorder = None
+        if self.RECORDER_ENABLED:
+            self.recorder = TrajectoryRecorder(
+                self.RECORDER_DIR,
+                self.state,
+                self.registry,
+                max_pending_ticks=self.RECORDER_MAX_PENDING_TICKS,
+                spill_ticks=self.RECORDER_SPILL_TICKS
+            )
+
+        # Background exporter, so serialization and upload never delay the next tick
+        self.exporter = StateExporter(
+            self.storage,
+            self.queue_urls[self.SIMCORE_QUEUE],
+            self.SIM_STATE_S3_KEY,
+            self.registry,
+            self.state,
+            bucket=self.S3_BUCKET
+        )
+        # Changes since the last export, handed to the exporter instead of a copy of the state
+        self.changes = {category: {} for category in DYNAMIC_CATEGORIES}
+
+        # Future-dated events posted by modules, fired in time order
+        self.scheduler = EventScheduler()
+
+        # On-demand profiler for the tick loop, idle until a ProfileControl message or signal
+        self.profiler = TickProfiler.from_config('SimCore', self.storage, self.PROFILING)
+
         # Initialize tick counter
         self.tick_number = 0
 
@@ -42,25 +111,22 @@ class SimCore:
             'road_blockages': {}
         }
 
-        # Load initial data from S3
-        s3_client = boto3.client('s3')
+        # Load initial data from the storage backend
         try:
             # Load intersections
             intersections_s3_url = self.S3_LINKS.get('intersections')
             if intersections_s3_url:
-                bucket_name, key = self.parse_s3_url(intersections_s3_url)
-                s3_client.download_file(bucket_name, key, 'intersections.parquet')
-                intersections_df = pd.read_parquet('intersections.parquet')
-                state['intersections'] = intersections_df.set_index('intersection_id').to_dict(orient='index')
+                intersections_df = storageUtility.read_parquet(self.storage, self.storage.key_from_link(intersections_s3_url))
+                intersections_df.index = self.registry.encode('intersection', intersections_df.pop('intersection_id'), strict=True)
+                state['intersections'] = intersections_df.to_dict(orient='index')
                 print(f"Loaded {len(state['intersections'])} intersections.")
 
             # Load roads
             roads_s3_url = self.S3_LINKS.get('roads')
             if roads_s3_url:
-                bucket_name, key = self.parse_s3_url(roads_s3_url)
-                s3_client.download_file(bucket_name, key, 'roads.parquet')
-                roads_df = pd.read_parquet('roads.parquet')
-                state['roads'] = roads_df.set_index('road_id').to_dict(orient='index')
+                roads_df = storageUtility.read_parquet(self.storage, self.storage.key_from_link(roads_s3_url))
+                roads_df.index = self.registry.encode('road', roads_df.pop('road_id'), strict=True)
+                state['roads'] = roads_df.to_dict(orient='index')
                 print(f"Loaded {len(state['roads'])} roads.")
 
         except Exception as e:
@@ -68,33 +134,23 @@ class SimCore:
 
         return state
 
-    def parse_s3_url(self, s3_url):
-        """Parse S3 URL to extract bucket name and key."""
-        s3_url = s3_url.replace("s3://", "")
-        bucket_name, key = s3_url.split('/', 1)
-        return bucket_name, key
-
     def run_simulation_loop(self):
         while True:
             # Send a SimulationTick event
             sqsUtility.send_message(self.queue_urls[self.SIMCORE_QUEUE], {
                 'type': 'SimulationTick',
-                'data': {'tick_number': self.tick_number}
+                'data': {'tick_number': self.tick_number, 'id_registry_version': self.registry.version}
             })
             print(f"Sent SimulationTick event for tick {self.tick_number}")
 
             # Wait for modules to process tick and send updates
             time.sleep(self.TICK_INTERVAL / 2)
 
-            # Receive updates from AgentModule and TrafficControlModule
-            self.receive_updates()
-
-            # Process updates and update internal state
-            self.run_simulation_step()
-
-            # Export the state every 10 ticks
-            if self.tick_number % 10 == 0:
-                self.export_state()
+            # Apply updates and close out the tick, under the profiler when one was requested
+            if self.profiler.active:
+                self.profiler.run_tick(self.process_tick)
+            else:
+                self.process_tick()
 
             # Increment tick number
             self.tick_number += 1
@@ -102,6 +158,29 @@ class SimCore:
             # Wait for the next tick
             time.sleep(self.TICK_INTERVAL / 2)
 
+    def process_tick(self):
+        """Apply the updates received for the current tick and record its results."""
+        # Receive updates from AgentModule and TrafficControlModule
+        self.receive_updates()
+
+        # Fire scheduled events that have come due
+        self.fire_due_events()
+
+        # Process updates and update internal state
+        self.run_simulation_step()
+
+        # Close this tick's per-road metrics
+        if self.metrics:
+            self.metrics.end_tick(self.tick_number)
+
+        # Record this tick's trajectory
+        if self.recorder:
+            self.recorder.record_tick(self.tick_number, self.state)
+
+        # Export the state every EXPORT_EVERY_TICKS ticks
+        if self.tick_number % self.EXPORT_EVERY_TICKS == 0:
+            self.export_state()
+
     def receive_updates(self):
         """Receive updates from AgentModule and TrafficControlModule."""
         messages = sqsUtility.receive_messages(self.queue_urls[self.SIMCORE_UPDATES_QUEUE], self.MAX_NUMBER_OF_MESSAGES)
@@ -117,72 +196,120 @@ class SimCore:
         data = message.get('data')
         if message_type == 'VehicleMoved':
             self.update_vehicle_state(data)
+        elif message_type == 'VehicleDespawned':
+            self.remove_vehicle_state(data)
         elif message_type == 'TRAFFIC_LIGHT_CHANGE':
             self.update_traffic_light_state(data)
         elif message_type == 'ROAD_BLOCKAGE':
             self.update_road_blockage_state(data)
+        elif message_type == 'ScheduleEvent':
+            self.schedule_event(data)
+        elif message_type == 'ProfileControl':
+            # Only SimCore reads this queue, so a message for another module is dropped rather than left behind
+            if not self.profiler.handle_control(data):
+                print(f"(SimCore) Ignoring ProfileControl for {data.get('module')}; post it on SimulationEvents")
         else:
             print(f"(SimCore) Unhandled message type: {message_type}")
 
+    def schedule_event(self, data):
+        """
+        Queue a future-dated event posted by a module.
+        The time is either absolute ('time', in ticks) or relative to the current tick ('delay').
+        """
+        event_time = data.get('time')
+        if event_time is None:
+            event_time = self.tick_number + data.get('delay', 0)
+        self.scheduler.schedule(event_time, data['event'], data.get('key'))
+
+    def fire_due_events(self):
+        """Apply every scheduled event due by the current tick and notify the modules."""
+        due = self.scheduler.pop_due(self.tick_number)
+        if not due:
+            return
+
+        notifications = []
+        for event_time, event in due:
+            if event.get('type') in STATE_EVENT_TYPES:
+                self.process_update_message(event)
+            notifications.append({
+                'type': 'ScheduledEvent',
+                'data': {
+                    'time': event_time,
+                    'tick_number': self.tick_number,
+                    'event': event
+                }
+            })
+
+        # Let the posting modules react, e.g. by scheduling the next light phase
+        sqsUtility.send_batch_messages(self.queue_urls[self.SCHEDULED_EVENTS_QUEUE], notifications)
+        print(f"Fired {len(due)} scheduled events at tick {self.tick_number}")
+
     def update_vehicle_state(self, data):
         vehicle_id = data['vehicle_id']
         road = data['road']
         position_on_road = data['position_on_road']
         # Update the vehicle's state in the simulation
-        self.state['vehicles'][vehicle_id] = {
+        # Speed and heading let the viz dead-reckon positions between exports
+        self.set_entry('vehicles', vehicle_id, {
             'road': road,
-            'position': position_on_road
-        }
+            'position': position_on_road,
+            'speed': data.get('speed', 0),
+            'heading': self.road_headings.get(road)
+        })
+        if self.metrics:
+            self.metrics.record_vehicle(vehicle_id, road, position_on_road, data.get('speed'))
+
+    def remove_vehicle_state(self, data):
+        vehicle_id = data['vehicle_id']
+        # The vehicle reached its destination and left the network
+        self.state['vehicles'].pop(vehicle_id, None)
+        self.changes['vehicles'][vehicle_id] = REMOVED
+        if self.metrics:
+            self.metrics.remove_vehicle(vehicle_id)
 
     def update_traffic_light_state(self, data):
         intersection = data['intersection']
         new_state = data['new_state']
         # Update the traffic light state
-        self.state['traffic_lights'][intersection] = new_state
+        self.set_entry('traffic_lights', intersection, new_state)
 
     def update_road_blockage_state(self, data):
         road = data['road']
         blockage_status = data['blockage_status']
         # Update the road blockage status
-        self.state['road_blockages'][road] = (blockage_status == 'blocked')
+        self.set_entry('road_blockages', road, blockage_status == 'blocked')
 
     def run_simulation_step(self):
         # Internal updates (if needed)
         pass
 
-    def export_state(self):
-        """Serialize the simulation state and upload it to S3."""
-        try:
-            # Convert state to JSON string
-            state_json = json.dumps(self.state)
-
-            # Upload to S3
-            self.s3_client.put_object(
-                Bucket=self.S3_BUCKET,
-                Key=self.SIM_STATE_S3_KEY,
-                Body=state_json
-            )
-
-            # Send notification to Visualization Module via SQS
-            sqsUtility.send_message(self.queue_urls[self.SIMCORE_QUEUE], {
-                'type': 'StateExported',
-                'data': {
-                    's3_bucket': self.S3_BUCKET,
-                    's3_key': self.SIM_STATE_S3_KEY,
-                    'tick_number': self.tick_number
-                }
-            })
-
-            print(f"Exported simulation state to s3://{self.S3_BUCKET}/{self.SIM_STATE_S3_KEY}")
-
-        except Exception as e:
-            print(f"Error exporting simulation state: {e}")
+    def set_entry(self, category, key, value):
+        # Entries are replaced, never mutated in place, so the exporter can share the values
+        self.state[category][key] = value
+        self.changes[category][key] = value
 
+    def export_state(self):
+        """Hand the changes since the last export to the background exporter."""
+        changes, self.changes = self.changes, {category: {} for category in DYNAMIC_CATEGORIES}
+        self.exporter.submit(self.tick_number, changes)
 
 if __name__ == "__main__":
     print("Starting SimCore...")
 
-    sim_core = SimCore()
+    with configUtility.startup_phase('SimCore init'):
+        sim_core = SimCore()
+    sim_core.profiler.install_signal_handlers(sim_core.PROFILING.get('signal_ticks', 10))
+    configUtility.print_startup_report('SimCore')
 
     # Start the simulation loop
-    sim_core.run_simulation_loop()
+    try:
+        sim_core.run_simulation_loop()
+    except KeyboardInterrupt:
+        print("SimCore stopped by user.")
+    finally:
+        # Write out any pending exports, buffered metrics and trajectory ticks before exiting
+        sim_core.exporter.stop()
+        if sim_core.metrics:
+            sim_core.metrics.flush()
+        if sim_core.recorder:
+            sim_core.recorder.spill()
@@ -0,0 +1,103 @@
+import json
+import threading
+from traffic_simulation.utils import sqsUtility
+
+# State categories SimCore changes while running; the rest (roads, intersections) are static
+DYNAMIC_CATEGORIES = ('vehicles', 'traffic_lights', 'road_blockages')
+# Marks an entry deleted since the previous export, e.g. a despawned vehicle
+REMOVED = object()
+
+
+class StateExporter:
+    """
+    Background worker that serializes, uploads and announces state snapshots.
+
+    Static tables are shared with SimCore by reference. For the dynamic
+    categories the exporter keeps its own copy, brought up to date from the
+    change sets SimCore hands over at each export, so the tick thread only
+    swaps out its change set and never copies the state. When the worker falls
+    behind, all pending change sets are applied and only the newest tick is
+    exported, so the viz always converges on the newest state.
+    """
+
+    def __init__(self, storage, queue_url, state_key, registry, state, bucket=None):
+        self.storage = storage
+        self.registry = registry
+        self.queue_url = queue_url
+        self.state_key = state_key
+        self.bucket = bucket
+        self.categories = list(state)
+        self.static = {category: entries for category, entries in state.items() if category not in DYNAMIC_CATEGORIES}
+        # Copied once here; from then on only the worker thread touches it
+        self.mirror = {category: dict(state.get(category, {})) for category in DYNAMIC_CATEGORIES}
+        self.pending = []
+        self.condition = threading.Condition()
+        self.running = True
+        self.dropped = 0
+        self.thread = threading.Thread(target=self.run, name='StateExporter', daemon=True)
+        self.thread.start()
+
+    def submit(self, tick_number, changes):
+        """Queue the changes since the previous export ({category: {key: value or REMOVED}})."""
+        with self.condition:
+            self.pending.append((tick_number, changes))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while self.running and not self.pending:
+                    self.condition.wait()
+                if not self.pending:
+                    return  # Stopped and drained
+                pending, self.pending = self.pending, []
+            if len(pending) > 1:
+                self.dropped += len(pending) - 1
+                print(f"(StateExporter) Exporter behind, skipping exports for ticks {[tick for tick, _ in pending[:-1]]}")
+            for _, changes in pending:
+                self.apply(changes)
+            self.export(pending[-1][0], self.snapshot())
+
+    def apply(self, changes):
+        for category, entries in changes.items():
+            mirror = self.mirror[category]
+            for key, value in entries.items():
+                if value is REMOVED:
+                    mirror.pop(key, None)
+                else:
+                    mirror[key] = value
+
+    def snapshot(self):
+        return {category: self.mirror.get(category, self.static.get(category)) for category in self.categories}
+
+    def export(self, tick_number, snapshot):
+        """Serialize the snapshot and write it to the storage backend."""
+        try:
+            # Restore string IDs, then convert state to JSON string
+            state_json = json.dumps(self.registry.export_state(snapshot))
+
+            # Write to storage
+            version = self.storage.put(self.state_key, state_json)
+
+            # Send notification to Visualization Module via SQS
+            sqsUtility.send_message(self.queue_url, {
+                'type': 'StateExported',
+                'data': {
+                    's3_bucket': self.bucket,
+                    's3_key': self.state_key,
+                    'version': version,
+                    'tick_number': tick_number
+                }
+            })
+
+            print(f"Exported simulation state to {self.state_key} (version {version})")
+
+        except Exception as e:
+            print(f"Error exporting simulation state: {e}")
+
+    def stop(self, timeout=None):
+        """Finish the pending exports and stop the worker."""
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join(timeout)
@@ -0,0 +1,175 @@
+import os
+import time
+import random
+import itertools
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import pandas as pd
+from traffic_simulation.utils import configUtility, storageUtility, idRegistry
+from traffic_simulation.core.agentModule import AgentModule
+from traffic_simulation.core.trafficModule import TrafficControlModule
+from traffic_simulation.core.roadMetrics import RoadMetrics
+
+# Scenario tables every run in a worker reads from; set once per worker by init_worker
+network = None
+
+
+def load_network(storage, s3_links, registry_key='id_registry.json'):
+    """Load the ID registry and scenario tables once, for every run of the sweep."""
+    shared = {'registry': idRegistry.load_registry(storage, s3_links, registry_key)}
+    for name in ('roads', 'vehicles', 'traffic_lights', 'road_blockages'):
+        link = s3_links.get(name)
+        shared[name] = storageUtility.read_parquet(storage, storage.key_from_link(link)) if link else None
+    print(f"Loaded scenario network ({', '.join(f'{len(df)} {name}' for name, df in shared.items() if isinstance(df, pd.DataFrame))})")
+    return shared
+
+
+def init_worker(shared_network):
+    # With fork the tables are inherited copy-on-write; with spawn they are unpickled once per worker
+    global network
+    network = shared_network
+
+
+def expand_grid(grid):
+    """Cartesian product of the grid's parameter lists, one dict per run."""
+    names = list(grid.keys())
+    values = [v if isinstance(v, list) else [v] for v in grid.values()]
+    return [dict(zip(names, combination)) for combination in itertools.product(*values)]
+
+
+def run_config(base_config, params):
+    """Module config for one in-process run: no queues, in-memory storage, the run's parameters applied."""
+    config = dict(base_config)
+    config.update({
+        'AGENT_MOD_QUEUES': [],
+        'TRAFFIC_MOD_QUEUES': [],
+        'STORAGE': {'backend': 'memory'},
+        'SCHEDULER_MODE': 'tick'  # Hybrid mode needs SimCore's event scheduler
+    })
+    # Upper-case parameters override config.json keys directly, e.g. SPEED_SCALE
+    config.update({name: value for name, value in params.items() if name.isupper()})
+
+    if 'blockage_probability' in params:
+        config['BLOCKAGE_PROBABILITY'] = params['blockage_probability']
+    demand = dict(config.get('DEMAND', {}))
+    if 'speed' in params:
+        demand['speed'] = params['speed']
+    if 'seed' in params:
+        demand['seed'] = params['seed']
+    config['DEMAND'] = demand
+    return config
+
+
+def place_vehicles(agent, count, speed, rng):
+    """Replace the scenario's vehicles with `count` free-roaming ones at random road positions."""
+    roads = np.flatnonzero(np.isfinite(agent.road_lengths))
+    road = rng.choice(roads, size=count).astype(np.int32)
+    position = rng.uniform(0.0, agent.road_lengths[road])
+    vehicle_ids = np.arange(agent.next_vehicle_number, agent.next_vehicle_number + count, dtype=np.int32)
+    slots = agent.pool.spawn(vehicle_ids, road, position, np.full(count, float(speed)), np.full(count, -1, dtype=np.int32))
+    agent.next_vehicle_number += len(slots)
+    agent.initialized = True
+
+
+def run_scenario(run_id, params, base_config, ticks):
+    """Run one simulation in-process and return its summary metrics."""
+    started = time.perf_counter()
+    config = run_config(base_config, params)
+    registry = network['registry']
+
+    seed = params.get('seed')
+    random.seed(seed)  # TrafficControlModule draws lights and blockages from the module-level RNG
+    rng = np.random.default_rng(seed)
+
+    agent = AgentModule(config)
+    vehicle_count = params.get('vehicle_count')
+    agent.setup(registry, network['roads'], None if vehicle_count is not None else network['vehicles'])
+    speed = params.get('speed', config['DEMAND'].get('speed', 20))
+    if vehicle_count is not None:
+        place_vehicles(agent, int(vehicle_count), speed, rng)
+    elif 'speed' in params:
+        agent.pool.speed[agent.pool.active] = speed
+    initial_vehicle_number = agent.next_vehicle_number
+
+    traffic = TrafficControlModule(config)
+    traffic.setup(registry, network['traffic_lights'], network['roads'], network['road_blockages'])
+
+    # Same per-road stage SimCore runs, read per tick instead of flushed to storage
+    metrics = RoadMetrics(traffic.state['roads'], None, registry, vehicle_length=config.get('VEHICLE_LENGTH', 0.005))
+    n_roads = max(1, len(traffic.state['roads']))
+
+    vehicle_ticks = 0
+    speed_sum = 0.0
+    throughput = 0
+    arrived = 0
+    blocked_ticks = 0
+    max_occupancy = 0.0
+    for tick_number in range(ticks):
+        # Apply the modules' updates directly, in the order SimCore would receive them
+        for update in agent.step(tick_number) + traffic.step():
+            data = update['data']
+            if update['type'] == 'VehicleMoved':
+                metrics.record_vehicle(data['vehicle_id'], data['road'], data['position_on_road'], data['speed'])
+            elif update['type'] == 'VehicleDespawned':
+                metrics.remove_vehicle(data['vehicle_id'])
+                arrived += 1
+
+        columns = metrics.close_tick(tick_number)
+        vehicle_ticks += int(columns['vehicle_count'].sum())
+        speed_sum += float((columns['avg_speed'] * columns['vehicle_count']).sum())
+        throughput += int(columns['throughput'].sum())
+        blocked_ticks += sum(traffic.state['road_blockages'].values())
+        if len(columns['occupancy']):
+            max_occupancy = max(max_occupancy, float(columns['occupancy'].max()))
+
+    return {
+        'run_id': run_id,
+        **params,
+        'ticks': ticks,
+        'mean_vehicles': vehicle_ticks / ticks if ticks else 0.0,
+        'mean_speed': speed_sum / vehicle_ticks if vehicle_ticks else 0.0,
+        'total_throughput': throughput,
+        'vehicles_spawned': agent.next_vehicle_number - initial_vehicle_number,
+        'vehicles_arrived': arrived,
+        'mean_blocked_fraction': blocked_ticks / (ticks * n_roads) if ticks else 0.0,
+        'max_occupancy': max_occupancy,
+        'runtime_seconds': time.perf_counter() - started
+    }
+
+
+def run_sweep(config):
+    """Run every grid point of the SWEEP config across a process pool and store one results table."""
+    sweep = config.get('SWEEP', {})
+    ticks = sweep.get('ticks', 600)
+    results_key = sweep.get('results_key', 'sweeps/results.parquet')
+    runs = expand_grid(sweep.get('grid', {}))
+
+    storage = storageUtility.get_storage(config)
+    shared = load_network(storage, config.get('S3_LINKS', {}), config.get('ID_REGISTRY_KEY', 'id_registry.json'))
+
+    # Prefer fork so workers share the loaded tables instead of each receiving a copy
+    context = multiprocessing.get_context('fork') if 'fork' in multiprocessing.get_all_start_methods() else None
+    print(f"Running {len(runs)} scenarios of {ticks} ticks on {sweep.get('workers') or os.cpu_count()} workers")
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=sweep.get('workers'), mp_context=context,
+                             initializer=init_worker, initargs=(shared,)) as executor:
+        futures = {executor.submit(run_scenario, run_id, params, config, ticks): run_id for run_id, params in enumerate(runs)}
+        for future in as_completed(futures):
+            try:
+                rows.append(future.result())
+                print(f"Finished run {futures[future]} ({len(rows)}/{len(runs)})")
+            except Exception as e:
+                print(f"Error in sweep run {futures[future]} {runs[futures[future]]}: {e}")
+
+    results_df = pd.DataFrame(rows).sort_values('run_id').reset_index(drop=True) if rows else pd.DataFrame()
+    storageUtility.write_parquet(storage, results_key, results_df)
+    print(f"Wrote {len(results_df)} sweep results to {results_key}")
+    return results_df
+
+
+if __name__ == "__main__":
+    print("Starting sweep runner...")
+
+    run_sweep(configUtility.get_config())
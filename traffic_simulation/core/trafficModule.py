@@ -1,13 +1,12 @@
 import json
-import os
 import time
-import pandas as pd
-import boto3
-from traffic_simulation.utils import sqsUtility
+from traffic_simulation.utils import configUtility, sqsUtility, storageUtility, idRegistry
+from traffic_simulation.utils.profilingUtility import TickProfiler
 import random
+import math
 
 class TrafficControlModule:
-    def __init__(self):
+    def __init__(self, config=None):
         self.state = {
             'traffic_lights': {},
             'roads': {},
@@ -15,18 +14,26 @@ class TrafficControlModule:
         }
         self.initialized = False
 
-        # Load configuration
-        config_file = os.path.join(os.path.dirname(__file__), 'config.json')
-        with open(config_file, 'r') as config_file:
-            CONFIG = json.load(config_file)
-            QUEUES = CONFIG.get('TRAFFIC_MOD_QUEUES', ['SimulationEvents', 'SimCoreUpdates'])
-            self.MAX_NUMBER_OF_MESSAGES = CONFIG.get('MAX_NUMBER_OF_MESSAGES', 10)
-            self.WAIT_TIME_SECONDS = CONFIG.get('WAIT_TIME_SECONDS', 1)
-            self.S3_LINKS = CONFIG.get('S3_LINKS', {})
+        # Shared configuration, unless one is passed in (e.g. by the sweep runner)
+        CONFIG = config if config is not None else configUtility.get_config()
+        QUEUES = CONFIG.get('TRAFFIC_MOD_QUEUES', ['SimulationEvents', 'SimCoreUpdates', 'TrafficControlEvents'])
+        self.MAX_NUMBER_OF_MESSAGES = CONFIG.get('MAX_NUMBER_OF_MESSAGES', 10)
+        self.WAIT_TIME_SECONDS = CONFIG.get('WAIT_TIME_SECONDS', 1)
+        self.S3_LINKS = CONFIG.get('S3_LINKS', {})
+        self.PROFILING = CONFIG.get('PROFILING', {})
+        self.ID_REGISTRY_KEY = CONFIG.get('ID_REGISTRY_KEY', 'id_registry.json')
+        # 'tick' re-evaluates every light and road each tick; 'hybrid' drives them by scheduled events
+        self.SCHEDULER_MODE = CONFIG.get('SCHEDULER_MODE', 'tick')
+        self.LIGHT_PHASE_TICKS = CONFIG.get('LIGHT_PHASE_TICKS', {'green': 1, 'yellow': 1, 'red': 1})
+        self.BLOCKAGE_PROBABILITY = CONFIG.get('BLOCKAGE_PROBABILITY', 0.1)  # Per road, per tick
+        self.BLOCKAGE_DURATION_TICKS = CONFIG.get('BLOCKAGE_DURATION_TICKS', 1)
+        # Fired-event notifications; only this module reads the queue, so none are lost to other consumers
+        self.SCHEDULED_EVENTS_QUEUE = CONFIG.get('SCHEDULED_EVENTS_QUEUE', 'TrafficControlEvents')
 
         self.queue_urls = sqsUtility.get_queue_urls(QUEUES)
-        # AWS S3 client
-        self.s3_client = boto3.client('s3')
+        self.storage = storageUtility.get_storage(CONFIG)
+        self.registry = None  # Shared string ID <-> int index registry, loaded with the initial state
+        self.profiler = TickProfiler.from_config('TrafficControlModule', self.storage, self.PROFILING)
 
     def poll_messages(self):
         messages = sqsUtility.receive_messages(self.queue_urls['SimulationEvents'], self.MAX_NUMBER_OF_MESSAGES)
@@ -34,94 +41,245 @@ class TrafficControlModule:
             body = json.loads(message['Body'])
             message_type = body.get('type')
             if message_type == 'SimulationTick' and self.initialized:
-                self.process_tick(body['data'])
+                if self.profiler.active:
+                    self.profiler.run_tick(self.process_tick, body['data'])
+                else:
+                    self.process_tick(body['data'])
+            elif message_type == 'ProfileControl':
+                if not self.profiler.handle_control(body.get('data', {})):
+                    continue
             else:
                 print(f"(TrafficControlModule) Unhandled message type: {message_type}", message)
 
             # Delete the message after processing
             sqsUtility.delete_message(self.queue_urls['SimulationEvents'], message['ReceiptHandle'])
 
+    def poll_scheduled_events(self):
+        """Handle fired-event notifications from SimCore (hybrid mode)."""
+        queue_url = self.queue_urls[self.SCHEDULED_EVENTS_QUEUE]
+        messages = sqsUtility.receive_messages(queue_url, self.MAX_NUMBER_OF_MESSAGES)
+        for message in messages:
+            try:
+                body = json.loads(message['Body'])
+                if body.get('type') == 'ScheduledEvent':
+                    # The scheduled events carry the per-tick work in hybrid mode, so they are profiled too
+                    if self.profiler.active:
+                        self.profiler.run_tick(self.process_scheduled_event, body['data'])
+                    else:
+                        self.process_scheduled_event(body['data'])
+                else:
+                    print(f"(TrafficControlModule) Unhandled scheduled event message: {body.get('type')}")
+            except Exception as e:
+                # Left undeleted, SQS redelivers it after the visibility timeout, keeping the event chain intact
+                print(f"(TrafficControlModule) Error handling scheduled event, leaving it for redelivery: {e}")
+                continue
+
+            sqsUtility.delete_message(queue_url, message['ReceiptHandle'])
+
     def load_initial_state(self):
-        """Download Parquet files from S3 and initialize the state."""
+        """Read Parquet files from storage and initialize the state."""
         try:
-            # Parse and download traffic lights
+            # Intersections and roads are keyed by their registry indices from here on
+            registry = idRegistry.load_registry(self.storage, self.S3_LINKS, self.ID_REGISTRY_KEY)
+
+            # Load traffic lights
+            traffic_lights_df = None
             traffic_lights_s3_url = self.S3_LINKS.get('traffic_lights')
             if traffic_lights_s3_url:
-                print(f"Downloading traffic lights from {traffic_lights_s3_url}")
-                bucket_name, key = self.parse_s3_url(traffic_lights_s3_url)
-                self.s3_client.download_file(bucket_name, key, 'traffic_lights.parquet')
-                traffic_lights_df = pd.read_parquet('traffic_lights.parquet')
-                self.state['traffic_lights'] = traffic_lights_df.set_index('intersection_id')['state'].to_dict()
-                print(f"Loaded {len(self.state['traffic_lights'])} traffic lights.")
+                print(f"Loading traffic lights from {traffic_lights_s3_url}")
+                traffic_lights_df = storageUtility.read_parquet(self.storage, self.storage.key_from_link(traffic_lights_s3_url))
             else:
                 print("No traffic lights S3 link provided.")
 
-            # Parse and download roads
+            # Load roads
+            roads_df = None
             roads_s3_url = self.S3_LINKS.get('roads')
             if roads_s3_url:
-                print(f"Downloading roads from {roads_s3_url}")
-                bucket_name, key = self.parse_s3_url(roads_s3_url)
-                self.s3_client.download_file(bucket_name, key, 'roads.parquet')
-                roads_df = pd.read_parquet('roads.parquet')
-                self.state['roads'] = roads_df.set_index('road_id').to_dict(orient='index')
-                print(f"Loaded {len(self.state['roads'])} roads.")
+                print(f"Loading roads from {roads_s3_url}")
+                roads_df = storageUtility.read_parquet(self.storage, self.storage.key_from_link(roads_s3_url))
             else:
                 print("No roads S3 link provided.")
 
-            # Parse and download road blockages
+            # Load road blockages
+            road_blockages_df = None
             road_blockages_s3_url = self.S3_LINKS.get('road_blockages')
             if road_blockages_s3_url:
-                print(f"Downloading road blockages from {road_blockages_s3_url}")
-                bucket_name, key = self.parse_s3_url(road_blockages_s3_url)
-                self.s3_client.download_file(bucket_name, key, 'road_blockages.parquet')
-                road_blockages_df = pd.read_parquet('road_blockages.parquet')
-                self.state['road_blockages'] = road_blockages_df.set_index('road_id')['blocked'].to_dict()
-                print(f"Loaded {len(self.state['road_blockages'])} road blockages.")
+                print(f"Loading road blockages from {road_blockages_s3_url}")
+                road_blockages_df = storageUtility.read_parquet(self.storage, self.storage.key_from_link(road_blockages_s3_url))
             else:
                 print("No road blockages S3 link provided.")
 
-            self.initialized = True
+            self.setup(registry, traffic_lights_df, roads_df, road_blockages_df)
         except Exception as e:
             print(f"Error loading initial state: {e}")
             self.initialized = False  # Ensure initialized remains False on error
 
-    def parse_s3_url(self, s3_url):
-        """Parse S3 URL to extract bucket name and key."""
-        s3_url = s3_url.replace("s3://", "")
-        bucket_name, key = s3_url.split('/', 1)
-        return bucket_name, key
+    def setup(self, registry, traffic_lights_df, roads_df, road_blockages_df):
+        """Build the index-keyed light, road and blockage state from already-loaded scenario data."""
+        self.registry = registry
+
+        if traffic_lights_df is not None:
+            intersections = self.registry.encode('intersection', traffic_lights_df['intersection_id'], strict=True).tolist()
+            self.state['traffic_lights'] = dict(zip(intersections, traffic_lights_df['state']))
+            print(f"Loaded {len(self.state['traffic_lights'])} traffic lights.")
+
+        if roads_df is not None:
+            roads_df = roads_df.set_index(self.registry.encode('road', roads_df['road_id'], strict=True)).drop(columns='road_id')
+            self.state['roads'] = roads_df.to_dict(orient='index')
+            print(f"Loaded {len(self.state['roads'])} roads.")
+
+        if road_blockages_df is not None:
+            roads = self.registry.encode('road', road_blockages_df['road_id'], strict=True).tolist()
+            self.state['road_blockages'] = dict(zip(roads, road_blockages_df['blocked'].tolist()))
+            print(f"Loaded {len(self.state['road_blockages'])} road blockages.")
+
+        self.initialized = True
 
     def process_tick(self, tick_data):
         """Update traffic lights and road blockages, then send updates to SimCore."""
+        if tick_data.get('id_registry_version', self.registry.version) != self.registry.version:
+            print(f"(TrafficControlModule) ID registry mismatch: SimCore has {tick_data['id_registry_version']}, we have {self.registry.version}")
+
+        if self.SCHEDULER_MODE == 'hybrid':
+            return  # Lights and blockages are driven by scheduled events instead
+
+        batch_updates = self.step()
+
+        # Send batch updates to SimCoreUpdates queue
+        sqsUtility.send_batch_messages(self.queue_urls['SimCoreUpdates'], batch_updates)
+        print(f"TrafficControlModule sent updates to SimCore for tick {tick_data['tick_number']}")
+
+    def step(self):
+        """Re-evaluate every light and road for one tick and return the resulting update messages."""
         batch_updates = []
 
         # Update traffic lights
         for intersection, light_state in self.state['traffic_lights'].items():
             new_state = self.change_traffic_light(intersection, light_state)
             self.state['traffic_lights'][intersection] = new_state
-            batch_updates.append({
-                'type': 'TRAFFIC_LIGHT_CHANGE',
-                'data': {
-                    'intersection': intersection,
-                    'new_state': new_state
-                }
-            })
+            batch_updates.append(self.light_update(intersection, new_state))
 
         # Update road blockages
         for road in self.state['roads'].keys():
             blockage_status = self.check_for_blockage(road)
             self.state['road_blockages'][road] = (blockage_status == 'blocked')
-            batch_updates.append({
-                'type': 'ROAD_BLOCKAGE',
-                'data': {
-                    'road': road,
-                    'blockage_status': blockage_status
-                }
-            })
+            batch_updates.append(self.blockage_update(road, blockage_status))
+        return batch_updates
+
+    def light_update(self, intersection, new_state):
+        return {
+            'type': 'TRAFFIC_LIGHT_CHANGE',
+            'data': {
+                'intersection': intersection,
+                'new_state': new_state
+            }
+        }
+
+    def blockage_update(self, road, blockage_status):
+        return {
+            'type': 'ROAD_BLOCKAGE',
+            'data': {
+                'road': road,
+                'blockage_status': blockage_status
+            }
+        }
+
+    def schedule_initial_events(self):
+        """Post the starting light and blockage state to SimCore, with the first change scheduled for every entity."""
+        batch_updates = []
+        for intersection, light_state in self.state['traffic_lights'].items():
+            # SimCore only learns of lights and blockages from these messages, so it starts from the current state
+            batch_updates.append(self.light_update(intersection, light_state))
+            batch_updates.append(self.light_change_event(intersection, light_state))
+        for road in self.state['roads'].keys():
+            blocked = self.state['road_blockages'].get(road, False)
+            batch_updates.append(self.blockage_update(road, 'blocked' if blocked else 'unblocked'))
+            if blocked:
+                batch_updates.append(self.blockage_event(road, 'unblocked', self.BLOCKAGE_DURATION_TICKS))
+            else:
+                batch_updates.append(self.blockage_event(road, 'blocked', self.sample_blockage_delay()))
+        batch_updates = [update for update in batch_updates if update is not None]
 
-        # Send batch updates to SimCoreUpdates queue
         sqsUtility.send_batch_messages(self.queue_urls['SimCoreUpdates'], batch_updates)
-        print(f"TrafficControlModule sent updates to SimCore for tick {tick_data['tick_number']}")
+        print(f"TrafficControlModule scheduled {len(batch_updates)} initial events")
+
+    def process_scheduled_event(self, event_data):
+        """Mirror a fired event locally and schedule the follow-up event for the same entity."""
+        event = event_data.get('event', {})
+        event_type = event.get('type')
+        data = event.get('data', {})
+
+        # Follow-ups are anchored to the tick the event was due, not when this notification arrived
+        fired_at = event_data.get('time')
+
+        if event_type == 'TRAFFIC_LIGHT_CHANGE':
+            intersection = data['intersection']
+            self.state['traffic_lights'][intersection] = data['new_state']
+            follow_up = self.light_change_event(intersection, data['new_state'], fired_at)
+        elif event_type == 'ROAD_BLOCKAGE':
+            road = data['road']
+            blocked = (data['blockage_status'] == 'blocked')
+            self.state['road_blockages'][road] = blocked
+            if blocked:
+                follow_up = self.blockage_event(road, 'unblocked', self.BLOCKAGE_DURATION_TICKS, fired_at)
+            else:
+                follow_up = self.blockage_event(road, 'blocked', self.sample_blockage_delay(), fired_at)
+        else:
+            return
+
+        if follow_up is not None:
+            sqsUtility.send_message(self.queue_urls['SimCoreUpdates'], follow_up)
+
+    def light_change_event(self, intersection, current_state, phase_start=None):
+        """
+        Build a ScheduleEvent for the end of the current light phase.
+        With phase_start the change gets an absolute time; otherwise it is relative to SimCore's tick.
+        """
+        return {
+            'type': 'ScheduleEvent',
+            'data': {
+                **self.event_time(self.LIGHT_PHASE_TICKS.get(current_state, 1), phase_start),
+                'key': f"light:{intersection}",
+                'event': {
+                    'type': 'TRAFFIC_LIGHT_CHANGE',
+                    'data': {
+                        'intersection': intersection,
+                        'new_state': self.change_traffic_light(intersection, current_state)
+                    }
+                }
+            }
+        }
+
+    def blockage_event(self, road, blockage_status, delay, start=None):
+        """Build a ScheduleEvent that sets a road's blockage status `delay` ticks after start (or from now)."""
+        if delay is None:
+            return None
+        return {
+            'type': 'ScheduleEvent',
+            'data': {
+                **self.event_time(delay, start),
+                'key': f"blockage:{road}",
+                'event': {
+                    'type': 'ROAD_BLOCKAGE',
+                    'data': {
+                        'road': road,
+                        'blockage_status': blockage_status
+                    }
+                }
+            }
+        }
+
+    def event_time(self, delay, start=None):
+        # SimCore takes either an absolute 'time' or a 'delay' from its current tick
+        return {'delay': delay} if start is None else {'time': start + delay}
+
+    def sample_blockage_delay(self):
+        # Ticks until the next blockage: geometric, matching a per-tick blockage probability
+        if self.BLOCKAGE_PROBABILITY <= 0:
+            return None  # Never blocks, so nothing to schedule
+        if self.BLOCKAGE_PROBABILITY >= 1:
+            return 1
+        return int(math.log(1.0 - random.random()) / math.log(1.0 - self.BLOCKAGE_PROBABILITY)) + 1
 
     def change_traffic_light(self, intersection, current_state):
         # Simple traffic light state change logic
@@ -136,21 +294,30 @@ class TrafficControlModule:
 
     def check_for_blockage(self, road):
         # Randomly decide if the road is blocked
-        return 'blocked' if random.random() < 0.1 else 'unblocked'
+        return 'blocked' if random.random() < self.BLOCKAGE_PROBABILITY else 'unblocked'
 
 if __name__ == "__main__":
     print("Starting TrafficControlModule...")
 
-    traffic_control = TrafficControlModule()
+    with configUtility.startup_phase('TrafficControlModule init'):
+        traffic_control = TrafficControlModule()
+    traffic_control.profiler.install_signal_handlers(traffic_control.PROFILING.get('signal_ticks', 10))
 
     # Load initial state
-    traffic_control.load_initial_state()
+    with configUtility.startup_phase('load initial state'):
+        traffic_control.load_initial_state()
+    configUtility.print_startup_report('TrafficControlModule')
 
     if traffic_control.initialized:
+        if traffic_control.SCHEDULER_MODE == 'hybrid':
+            traffic_control.schedule_initial_events()
+
         try:
             # Start polling messages
             while True:
                 traffic_control.poll_messages()
+                if traffic_control.SCHEDULER_MODE == 'hybrid':
+                    traffic_control.poll_scheduled_events()
                 time.sleep(0.1)  # Small delay to prevent tight loop
 
         except KeyboardInterrupt:
@@ -0,0 +1,211 @@
+import os
+import json
+from collections import deque
+import numpy as np
+from traffic_simulation.utils.idRegistry import IdRegistry
+
+# On-disk layout of a trajectory directory (all binary files are little-endian and append-only):
+#   meta.json        static road/intersection tables, the ID registry and the column codes
+#   ticks.bin        one TICK_DTYPE record per tick: where that tick's rows live in the columns
+#   vehicle.i4, road.i4, position.f4
+#                    one entry per (tick, vehicle) row
+#   lights.i1        one code per intersection per tick
+#   blockages.u1     one flag per road per tick
+TICK_DTYPE = np.dtype([('tick_number', '<i8'), ('row_offset', '<i8'), ('row_count', '<i8')])
+VEHICLE_COLUMNS = {'vehicle': '<i4', 'road': '<i4', 'position': '<f4'}
+DATA_FILES = ['ticks.bin', 'vehicle.i4', 'road.i4', 'position.f4', 'lights.i1', 'blockages.u1']
+LIGHT_CODES = {'red': 0, 'yellow': 1, 'green': 2}
+
+
+class TrajectoryRecorder:
+    """
+    Records positions, light states and blockages for every tick.
+
+    Ticks are buffered in memory only until they are spilled, in batches, to
+    fixed-width columnar files that TrajectoryReader can memory-map. If spills
+    keep failing, at most max_pending_ticks are held and the oldest are dropped.
+    """
+
+    def __init__(self, directory, state, registry, max_pending_ticks=600, spill_ticks=60):
+        self.directory = directory
+        self.spill_ticks = max(1, spill_ticks)
+        self.pending = deque(maxlen=max(max_pending_ticks, self.spill_ticks))  # Ticks not yet on disk, oldest first
+
+        os.makedirs(self.directory, exist_ok=True)
+        # State is keyed by registry indices, which are written to the columns as-is
+        self.road_ids = list(range(registry.count('road')))
+        self.intersection_ids = list(range(registry.count('intersection')))
+
+        # Each run starts a fresh recording, like the overwritten state export
+        for filename in DATA_FILES:
+            path = os.path.join(self.directory, filename)
+            if os.path.exists(path):
+                os.remove(path)
+        self.row_offset = 0
+
+        with open(os.path.join(self.directory, 'meta.json'), 'w') as f:
+            static_state = registry.export_state({'roads': state['roads'], 'intersections': state['intersections']})
+            json.dump({
+                'roads': static_state['roads'],
+                'intersections': static_state['intersections'],
+                'id_registry': registry.to_dict(),
+                'light_codes': LIGHT_CODES
+            }, f)
+
+    def column_path(self, name):
+        return os.path.join(self.directory, f"{name}.{VEHICLE_COLUMNS[name][1:]}")  # e.g. vehicle.i4
+
+    def record_tick(self, tick_number, state):
+        """Snapshot the current state, spilling to disk once a batch is complete."""
+        vehicles = state['vehicles']
+        count = len(vehicles)
+        vehicle = np.fromiter(vehicles.keys(), dtype=np.int32, count=count)
+        road = np.fromiter((v.get('road', -1) for v in vehicles.values()), dtype=np.int32, count=count)
+        position = np.fromiter((v.get('position', 0) for v in vehicles.values()), dtype=np.float32, count=count)
+
+        traffic_lights = state['traffic_lights']
+        lights = np.array([LIGHT_CODES.get(traffic_lights.get(i), -1) for i in self.intersection_ids], dtype=np.int8)
+        road_blockages = state['road_blockages']
+        blockages = np.array([bool(road_blockages.get(r, False)) for r in self.road_ids], dtype=np.uint8)
+
+        if len(self.pending) == self.pending.maxlen:
+            print(f"Trajectory spills are failing; dropping unspilled tick {self.pending[0]['tick_number']}")
+        self.pending.append({
+            'tick_number': tick_number,
+            'vehicle': vehicle,
+            'road': road,
+            'position': position,
+            'lights': lights,
+            'blockages': blockages
+        })
+        if len(self.pending) >= self.spill_ticks:
+            self.spill()
+
+    def spill(self):
+        """Append the pending ticks to the columnar files, all or nothing."""
+        if not self.pending:
+            return
+        records = list(self.pending)
+        paths = [self.column_path(name) for name in VEHICLE_COLUMNS] + [
+            os.path.join(self.directory, filename) for filename in ('lights.i1', 'blockages.u1', 'ticks.bin')
+        ]
+        sizes = {path: os.path.getsize(path) if os.path.exists(path) else 0 for path in paths}
+        row_offset = self.row_offset
+        try:
+            for name, dtype in VEHICLE_COLUMNS.items():
+                with open(self.column_path(name), 'ab') as f:
+                    f.write(np.concatenate([r[name] for r in records]).astype(dtype, copy=False).tobytes())
+            with open(os.path.join(self.directory, 'lights.i1'), 'ab') as f:
+                f.write(np.concatenate([r['lights'] for r in records]).tobytes())
+            with open(os.path.join(self.directory, 'blockages.u1'), 'ab') as f:
+                f.write(np.concatenate([r['blockages'] for r in records]).tobytes())
+
+            # The tick index goes last, so readers never see a tick whose rows are missing
+            ticks = np.empty(len(records), dtype=TICK_DTYPE)
+            for i, r in enumerate(records):
+                ticks[i] = (r['tick_number'], row_offset, len(r['vehicle']))
+                row_offset += len(r['vehicle'])
+            with open(os.path.join(self.directory, 'ticks.bin'), 'ab') as f:
+                f.write(ticks.tobytes())
+        except Exception as e:
+            # Cut every file back to where it was, so the offsets stay valid; the ticks are retried next spill
+            print(f"Error spilling trajectory to {self.directory}, keeping {len(records)} ticks pending: {e}")
+            self.truncate(sizes)
+            return
+        self.row_offset = row_offset
+        self.pending.clear()
+
+    def truncate(self, sizes):
+        for path, size in sizes.items():
+            try:
+                if os.path.exists(path) and os.path.getsize(path) > size:
+                    os.truncate(path, size)
+            except OSError as e:
+                print(f"Error truncating {path} back to {size} bytes: {e}")
+
+
+class TrajectoryReader:
+    """Memory-mapped random access to a recorded trajectory directory."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.meta_version = None
+        self.load_meta()
+
+    def load_meta(self):
+        """(Re)load the static tables and ID registry, dropping every mapping from an earlier recording."""
+        path = os.path.join(self.directory, 'meta.json')
+        stat = os.stat(path)
+        with open(path, 'r') as f:
+            meta = json.load(f)
+        self.meta_version = (stat.st_mtime_ns, stat.st_size)
+        self.roads = meta['roads']
+        self.intersections = meta['intersections']
+        self.registry = IdRegistry.from_dict(meta['id_registry'])
+        self.road_ids = self.registry.names['road']
+        self.intersection_ids = self.registry.names['intersection']
+        self.light_names = {code: name for name, code in meta['light_codes'].items()}
+        self.maps = {}
+        self.sizes = {}
+
+    def _map(self, filename, dtype):
+        # Re-map only when the file has grown since the last look
+        path = os.path.join(self.directory, filename)
+        size = os.path.getsize(path) if os.path.exists(path) else 0
+        if self.sizes.get(filename) != size:
+            length = size // np.dtype(dtype).itemsize
+            self.maps[filename] = np.memmap(path, dtype=dtype, mode='r', shape=(length,)) if length else np.empty(0, dtype=dtype)
+            self.sizes[filename] = size
+        return self.maps[filename]
+
+    def ticks(self):
+        # Every recording rewrites meta.json, so a changed one means a new run (possibly another scenario)
+        stat = os.stat(os.path.join(self.directory, 'meta.json'))
+        if (stat.st_mtime_ns, stat.st_size) != self.meta_version:
+            self.load_meta()
+        path = os.path.join(self.directory, 'ticks.bin')
+        if os.path.exists(path) and os.path.getsize(path) < self.sizes.get('ticks.bin', 0):
+            # Replaced before its meta.json was rewritten; drop the stale mappings until it is
+            self.maps = {}
+            self.sizes = {}
+        return self._map('ticks.bin', TICK_DTYPE)
+
+    def tick_range(self):
+        """Return (first, last) recorded tick numbers, or None if nothing is on disk yet."""
+        ticks = self.ticks()
+        if not len(ticks):
+            return None
+        return int(ticks['tick_number'][0]), int(ticks['tick_number'][-1])
+
+    def read_tick(self, tick_number):
+        """Rebuild the state for the latest recorded tick at or before tick_number."""
+        ticks = self.ticks()
+        i = int(np.searchsorted(ticks['tick_number'], tick_number, side='right')) - 1
+        if i < 0:
+            return None
+        tick = ticks[i]
+        start, stop = int(tick['row_offset']), int(tick['row_offset'] + tick['row_count'])
+
+        vehicle = self._map('vehicle.i4', '<i4')[start:stop]
+        road = self._map('road.i4', '<i4')[start:stop]
+        position = self._map('position.f4', '<f4')[start:stop]
+
+        n_lights = len(self.intersection_ids)
+        n_roads = len(self.road_ids)
+        lights = self._map('lights.i1', '<i1')[i * n_lights:(i + 1) * n_lights]
+        blockages = self._map('blockages.u1', '<u1')[i * n_roads:(i + 1) * n_roads]
+
+        return {
+            'tick_number': int(tick['tick_number']),
+            'intersections': self.intersections,
+            'roads': self.roads,
+            'vehicles': {
+                self.registry.name('vehicle', v): {'road': self.registry.name('road', r), 'position': float(p)}
+                for v, r, p in zip(vehicle.tolist(), road.tolist(), position.tolist())
+            },
+            'traffic_lights': {
+                intersection_id: self.light_names.get(code, 'unknown')
+                for intersection_id, code in zip(self.intersection_ids, lights.tolist())
+            },
+            'road_blockages': {road_id: bool(b) for road_id, b in zip(self.road_ids, blockages.tolist())}
+        }
@@ -0,0 +1,54 @@
+import numpy as np
+
+class VehiclePool:
+    """
+    Preallocated struct-of-arrays vehicle storage with a free list.
+
+    Spawning pops slots off the free-list stack and despawning pushes them back,
+    so the arrays are never reallocated and slot indices stay stable while a
+    vehicle is alive.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.vehicle_ids = np.full(capacity, -1, dtype=np.int32)  # Registry vehicle index, -1 = free slot
+        self.road = np.full(capacity, -1, dtype=np.int32)  # Index into the module's road table
+        self.position = np.zeros(capacity, dtype=float)
+        self.speed = np.zeros(capacity, dtype=float)
+        self.destination = np.full(capacity, -1, dtype=np.int32)  # OD destination index, -1 = free roaming
+        self.active = np.zeros(capacity, dtype=bool)
+
+        # free_slots[:free_top] are free; the top of the stack is the end
+        self.free_slots = np.arange(capacity - 1, -1, -1, dtype=np.int64)
+        self.free_top = capacity
+
+    def __len__(self):
+        return self.capacity - self.free_top
+
+    def spawn(self, vehicle_ids, road, position, speed, destination):
+        """
+        Place vehicles into free slots and return the slots used.
+        If the pool runs out, the excess vehicles are not spawned.
+        """
+        count = min(len(vehicle_ids), self.free_top)
+        slots = self.free_slots[self.free_top - count:self.free_top].copy()
+        self.free_top -= count
+
+        self.vehicle_ids[slots] = vehicle_ids[:count]
+        self.road[slots] = road[:count]
+        self.position[slots] = position[:count]
+        self.speed[slots] = speed[:count]
+        self.destination[slots] = destination[:count]
+        self.active[slots] = True
+        return slots
+
+    def despawn(self, slots):
+        """Release slots back to the free list."""
+        count = len(slots)
+        self.active[slots] = False
+        self.vehicle_ids[slots] = -1
+        self.free_slots[self.free_top:self.free_top + count] = slots
+        self.free_top += count
+
+    def active_slots(self):
+        return np.flatnonzero(self.active)
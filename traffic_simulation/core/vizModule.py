@@ -1,49 +1,82 @@
 import json
 import dash
 from dash import dcc, html
-from dash.dependencies import Input, Output
+from dash.dependencies import Input, Output, State
 import plotly.graph_objects as go
-import pandas as pd
+import numpy as np
 import os
-import boto3
-from traffic_simulation.utils import sqsUtility
+import time
+from traffic_simulation.utils import configUtility, sqsUtility, storageUtility
+from traffic_simulation.utils.profilingUtility import TickProfiler
+from traffic_simulation.core.trajectoryRecorder import TrajectoryReader
+
+# Only needed once the first figure is built, so it loads after the server is up
+pd = configUtility.lazy_import('pandas')
 
 # Initialize the Dash app
 app = dash.Dash(__name__)
 app.title = 'Traffic Simulation Visualization'
 
 # Load configuration
-config_file = os.path.join(os.path.dirname(__file__), 'config.json')
-with open(config_file, 'r') as config_file:
-    CONFIG = json.load(config_file)
-    QUEUES = CONFIG.get('VIZ_MOD_QUEUES', ['SimulationEvents'])
-    MAX_NUMBER_OF_MESSAGES = CONFIG.get('MAX_NUMBER_OF_MESSAGES', 10)
-    WAIT_TIME_SECONDS = CONFIG.get('WAIT_TIME_SECONDS', 1)
-    AWS_REGION = CONFIG.get('AWS_REGION', 'us-east-1')
+CONFIG = configUtility.get_config()
+QUEUES = CONFIG.get('VIZ_MOD_QUEUES', ['SimulationEvents'])
+MAX_NUMBER_OF_MESSAGES = CONFIG.get('MAX_NUMBER_OF_MESSAGES', 10)
+WAIT_TIME_SECONDS = CONFIG.get('WAIT_TIME_SECONDS', 1)
+VIZ_LOD_MAX_MARKERS = CONFIG.get('VIZ_LOD_MAX_MARKERS', 5000)  # Individual markers only below this count
+VIZ_LOD_BINS = CONFIG.get('VIZ_LOD_BINS', 100)  # Heatmap bins per axis when zoomed out
+RECORDER_DIR = CONFIG.get('RECORDER_DIR', 'trajectories')  # Shared with SimCore's trajectory recorder
+TICK_INTERVAL = CONFIG.get('TICK_INTERVAL', 1)
+SPEED_SCALE = CONFIG.get('SPEED_SCALE', 0.01)  # Road length units moved per tick per unit of speed
+VIZ_ANIMATION_INTERVAL_MS = CONFIG.get('VIZ_ANIMATION_INTERVAL_MS', 100)  # Client-side interpolation frame time
+PROFILING = CONFIG.get('PROFILING', {})
+
+storage = storageUtility.get_storage(CONFIG)
 
-# Initialize AWS clients
-s3_client = boto3.client('s3', region_name=AWS_REGION)
+# Profiles the figure-building callback
+profiler = TickProfiler.from_config('vizModule', storage, PROFILING)
 
 # Initialize SQS client and get queue URLs
 queue_urls = sqsUtility.get_queue_urls(QUEUES)
 simulation_events_queue_url = queue_urls['SimulationEvents']
 
-# Shared variable to store the latest state
+# Shared variables to store the latest state and its storage version
 latest_state = {}
+latest_version = None
+latest_received_at = None  # When latest_state arrived; the origin for dead reckoning
+
+# Memory-mapped trajectory reader for replay mode, opened on first use
+trajectory_reader = None
 
 # Define the layout
 app.layout = html.Div(children=[
     dcc.Graph(id='simulation-graph'),
+    html.Div(children=[
+        dcc.RadioItems(
+            id='mode-selector',
+            options=[{'label': 'Live', 'value': 'live'}, {'label': 'Replay', 'value': 'replay'}],
+            value='live',
+            inline=True
+        ),
+        dcc.Slider(id='replay-slider', min=0, max=0, step=1, value=0, marks=None,
+                   tooltip={'placement': 'bottom'})
+    ]),
+    dcc.Store(id='viewport-store'),  # Visible axis ranges, driven by relayoutData
+    dcc.Store(id='figure-store'),  # Server-built figure plus per-vehicle motion for interpolation
     dcc.Interval(
         id='interval-component',
         interval=1 * 1000,  # Update every 1 second
         n_intervals=0
+    ),
+    dcc.Interval(
+        id='animation-interval',
+        interval=VIZ_ANIMATION_INTERVAL_MS,  # Browser-side frames between server updates
+        n_intervals=0
     )
 ])
 
 # Helper function to poll SQS and process StateExported messages
 def poll_and_update_state():
-    global latest_state  # Use shared variable for latest state
+    global latest_state, latest_version, latest_received_at  # Use shared variables for latest state
 
     try:
         messages = sqsUtility.receive_messages(
@@ -59,20 +92,24 @@ def poll_and_update_state():
 
             if message_type == 'StateExported':
                 data = body.get('data', {})
-                s3_bucket = data.get('s3_bucket')
                 s3_key = data.get('s3_key')
                 tick_number = data.get('tick_number')
 
-                # Download the sim_state.json from S3
-                if s3_bucket and s3_key:
+                # Read the sim_state.json, skipping the transfer if we already hold this version
+                if s3_key and (data.get('version') is None or data.get('version') != latest_version):
                     try:
-                        response = s3_client.get_object(Bucket=s3_bucket, Key=s3_key)
-                        state_json = response['Body'].read().decode('utf-8')
-                        latest_state = json.loads(state_json)  # Update latest state
-
-                        print(f"Updated state for tick {tick_number}")
+                        state, version = storageUtility.read_json(storage, s3_key, latest_version)
+                        if state is not None:
+                            latest_state = state  # Update latest state
+                            latest_version = version
+                            latest_received_at = time.time()
+                            print(f"Updated state for tick {tick_number}")
                     except Exception as e:
-                        print(f"Error downloading state from S3: {e}")
+                        print(f"Error reading state from storage: {e}")
+
+            elif message_type == 'ProfileControl':
+                if not profiler.handle_control(body.get('data', {})):
+                    continue
 
             # Delete the message from the queue once it's processed
             sqsUtility.delete_message(simulation_events_queue_url, message['ReceiptHandle'])
@@ -80,6 +117,16 @@ def poll_and_update_state():
     except Exception as e:
         print(f"Error receiving messages: {e}")
 
+# Helper function to open the trajectory recording once SimCore has started writing it
+def get_trajectory_reader():
+    global trajectory_reader
+    if trajectory_reader is None and os.path.exists(os.path.join(RECORDER_DIR, 'meta.json')):
+        try:
+            trajectory_reader = TrajectoryReader(RECORDER_DIR)
+        except Exception as e:
+            print(f"Error opening trajectory recording: {e}")
+    return trajectory_reader
+
 # Helper function to create road lines
 def create_road_lines(roads_df):
     road_shapes = []
@@ -144,23 +191,215 @@ def create_traffic_light_markers(intersections_df, traffic_lights):
             traffic_light_markers.append(marker)
     return traffic_light_markers
 
-# Callback to update the graph
+# Helper function to compute vehicle x/y coordinates in one vectorized pass
+def compute_vehicle_positions(vehicles, roads_df):
+    vehicles_df = pd.DataFrame.from_dict(vehicles, orient='index')
+    vehicles_df.index.name = 'vehicle_id'
+    vehicles_df = vehicles_df.reset_index()
+
+    # Attach road geometry to every vehicle; vehicles on unknown roads are dropped
+    geometry = roads_df[['road_id', 'start_x', 'start_y', 'end_x', 'end_y', 'length']]
+    merged = vehicles_df.merge(geometry, left_on='road', right_on='road_id', how='inner')
+
+    length = merged['length'].to_numpy(dtype=float)
+    position = merged['position'].to_numpy(dtype=float)
+    t = np.full(len(merged), 0.5)
+    np.divide(position, length, out=t, where=length > 0)
+    # Vehicles past the end of their road wait at its end, as in the client-side interpolation
+    np.clip(t, 0.0, 1.0, out=t)
+
+    x = merged['start_x'].to_numpy(dtype=float) + t * (merged['end_x'].to_numpy(dtype=float) - merged['start_x'].to_numpy(dtype=float))
+    y = merged['start_y'].to_numpy(dtype=float) + t * (merged['end_y'].to_numpy(dtype=float) - merged['start_y'].to_numpy(dtype=float))
+    return merged, x, y
+
+# Helper function to describe how each marker moves along its road until the next snapshot
+def create_vehicle_motion(merged, trace_index, received_at):
+    speed = merged['speed'].fillna(0).to_numpy(dtype=float) if 'speed' in merged else np.zeros(len(merged))
+    return {
+        'trace_index': trace_index,
+        'snapshot_id': received_at,
+        'age': time.time() - received_at,  # Seconds already elapsed since the snapshot arrived
+        'start_x': merged['start_x'].tolist(),
+        'start_y': merged['start_y'].tolist(),
+        'dx': (merged['end_x'] - merged['start_x']).tolist(),
+        'dy': (merged['end_y'] - merged['start_y']).tolist(),
+        'length': merged['length'].tolist(),
+        'position': merged['position'].tolist(),
+        'rate': (speed * SPEED_SCALE / TICK_INTERVAL).tolist()  # Road length units per second
+    }
+
+# Helper function to extract the visible axis ranges from a graph's relayoutData
+def parse_viewport(relayout_data, previous_viewport=None):
+    viewport = dict(previous_viewport or {})
+    if not relayout_data:
+        return viewport
+
+    for axis in ('xaxis', 'yaxis'):
+        if relayout_data.get(f'{axis}.autorange'):
+            viewport.pop(axis, None)
+        elif f'{axis}.range[0]' in relayout_data and f'{axis}.range[1]' in relayout_data:
+            viewport[axis] = [relayout_data[f'{axis}.range[0]'], relayout_data[f'{axis}.range[1]']]
+        elif f'{axis}.range' in relayout_data:
+            viewport[axis] = list(relayout_data[f'{axis}.range'])
+    return viewport
+
+# Helper function to resolve the viewport to concrete bounds
+# An axis the user has not zoomed spans every vehicle, so none are hidden by default
+def viewport_bounds(viewport, x, y):
+    x_range = viewport.get('xaxis') if viewport else None
+    y_range = viewport.get('yaxis') if viewport else None
+    if x_range is None:
+        x_range = [x.min(), x.max()]
+    if y_range is None:
+        y_range = [y.min(), y.max()]
+    return sorted(map(float, x_range)), sorted(map(float, y_range))
+
+# Helper function to create the vehicle layer at the right level of detail
+# Returns the trace and the visible mask, or None for the mask when vehicles are aggregated
+def create_vehicle_layer(vehicle_ids, x, y, x_range, y_range):
+    visible = (x >= x_range[0]) & (x <= x_range[1]) & (y >= y_range[0]) & (y <= y_range[1])
+    visible_count = int(np.count_nonzero(visible))
+
+    if visible_count <= VIZ_LOD_MAX_MARKERS:
+        # Zoomed in far enough: send only the visible vehicles as individual markers
+        return go.Scattergl(
+            x=x[visible],
+            y=y[visible],
+            mode='markers',
+            marker=dict(size=10, color='blue', symbol='triangle-up'),
+            name='Vehicles',
+            hovertext=vehicle_ids[visible]
+        ), visible
+
+    # Zoomed out: aggregate into a fixed-size density grid over the viewport
+    # Guard against zero-width ranges (e.g. all roads on one axis line)
+    if x_range[0] == x_range[1]:
+        x_range = [x_range[0] - 0.5, x_range[1] + 0.5]
+    if y_range[0] == y_range[1]:
+        y_range = [y_range[0] - 0.5, y_range[1] + 0.5]
+    counts, x_edges, y_edges = np.histogram2d(
+        x[visible], y[visible], bins=VIZ_LOD_BINS, range=[x_range, y_range]
+    )
+    density = counts.T  # Heatmap expects z[row=y][col=x]
+    density[density == 0] = np.nan  # Leave empty bins transparent
+    return go.Heatmap(
+        x=(x_edges[:-1] + x_edges[1:]) / 2,
+        y=(y_edges[:-1] + y_edges[1:]) / 2,
+        z=density,
+        colorscale='Blues',
+        colorbar=dict(title='Vehicles'),
+        name=f'Vehicle density ({visible_count} visible)',
+        hoverongaps=False,
+        showscale=True
+    ), None
+
+# Callback to remember the visible range whenever the user zooms or pans
 @app.callback(
-    Output('simulation-graph', 'figure'),
+    Output('viewport-store', 'data'),
+    Input('simulation-graph', 'relayoutData'),
+    State('viewport-store', 'data')
+)
+def update_viewport(relayout_data, viewport):
+    return parse_viewport(relayout_data, viewport)
+
+# Callback to keep the replay slider spanning the recorded ticks
+@app.callback(
+    Output('replay-slider', 'min'),
+    Output('replay-slider', 'max'),
     Input('interval-component', 'n_intervals')
 )
-def update_graph(n):
+def update_replay_slider(n):
+    reader = get_trajectory_reader()
+    tick_range = reader.tick_range() if reader else None
+    if tick_range is None:
+        return 0, 0
+    return tick_range
+
+# Callback to rebuild the figure on the server
+@app.callback(
+    Output('figure-store', 'data'),
+    Input('interval-component', 'n_intervals'),
+    Input('viewport-store', 'data'),
+    Input('mode-selector', 'value'),
+    Input('replay-slider', 'value')
+)
+def update_graph(n, viewport, mode, replay_tick):
+    if profiler.active:
+        return profiler.run_tick(render_graph, viewport, mode, replay_tick)
+    return render_graph(viewport, mode, replay_tick)
+
+def render_graph(viewport, mode, replay_tick):
     # Call the function to poll SQS and update the latest state
     poll_and_update_state()
 
+    if mode == 'replay':
+        # Jump straight to the requested tick in the memory-mapped recording
+        reader = get_trajectory_reader()
+        state = reader.read_tick(replay_tick or 0) if reader else None
+        if not state:
+            fig = go.Figure()
+            fig.update_layout(title='No recorded trajectory yet...')
+            return {'figure': fig.to_dict(), 'motion': None}
+        fig, _ = build_figure(state, viewport, f"Replay - tick {state['tick_number']}")
+        return {'figure': fig.to_dict(), 'motion': None}  # Replay shows recorded ticks as-is
+
     # If no state is available, display a placeholder graph
     if not latest_state:
         fig = go.Figure()
         fig.update_layout(title='Waiting for simulation data...')
-        return fig
+        return {'figure': fig.to_dict(), 'motion': None}
+
+    fig, motion = build_figure(latest_state, viewport, 'Traffic Simulation Visualization', latest_received_at)
+    return {'figure': fig.to_dict(), 'motion': motion}
 
-    # Extract data from the latest state
-    state = latest_state
+# Browser-side callback: dead-reckon vehicle markers along their roads between server updates
+app.clientside_callback(
+    """
+    function(stored, n) {
+        if (!stored) {
+            return window.dash_clientside.no_update;
+        }
+        const motion = stored.motion;
+        if (!motion) {
+            // Nothing to animate; only redraw when the server sent something new
+            if (window.vizRenderedStore === stored) {
+                return window.dash_clientside.no_update;
+            }
+            window.vizRenderedStore = stored;
+            return stored.figure;
+        }
+        if (window.vizSnapshotId !== motion.snapshot_id) {
+            // Anchor the snapshot to the browser clock to avoid server/browser clock skew
+            window.vizSnapshotId = motion.snapshot_id;
+            window.vizSnapshotArrival = Date.now() - motion.age * 1000;
+        }
+        window.vizRenderedStore = stored;
+        const elapsed = Math.max(0, (Date.now() - window.vizSnapshotArrival) / 1000);
+        const count = motion.position.length;
+        const x = new Array(count);
+        const y = new Array(count);
+        for (let i = 0; i < count; i++) {
+            const length = motion.length[i];
+            // Stop at the road end; the next snapshot carries the vehicle onto its next road
+            const position = Math.min(motion.position[i] + motion.rate[i] * elapsed, length);
+            const t = length > 0 ? position / length : 0.5;
+            x[i] = motion.start_x[i] + t * motion.dx[i];
+            y[i] = motion.start_y[i] + t * motion.dy[i];
+        }
+        const data = stored.figure.data.slice();
+        data[motion.trace_index] = Object.assign({}, data[motion.trace_index], {x: x, y: y});
+        return Object.assign({}, stored.figure, {data: data});
+    }
+    """,
+    Output('simulation-graph', 'figure'),
+    Input('figure-store', 'data'),
+    Input('animation-interval', 'n_intervals')
+)
+
+# Helper function to build the full figure for a state snapshot
+# Returns the figure and the vehicle motion for client-side interpolation (None if not animatable)
+def build_figure(state, viewport, title, received_at=None):
+    # Extract data from the state
     vehicles = state.get('vehicles', {})
     traffic_lights = state.get('traffic_lights', {})
     road_blockages = state.get('road_blockages', {})
@@ -192,45 +431,32 @@ def update_graph(n):
         for marker in traffic_light_markers:
             fig.add_trace(marker)
 
-    # Add vehicle positions
+    # Add vehicle positions, as markers or a density heatmap depending on the visible count
+    motion = None
     if vehicles and roads:
-        vehicles_df = pd.DataFrame.from_dict(vehicles, orient='index').reset_index()
-        vehicles_df.rename(columns={'index': 'vehicle_id'}, inplace=True)
-
-        vehicle_positions = []
-        for _, vehicle in vehicles_df.iterrows():
-            road_id = vehicle['road']
-            road = roads_df.loc[roads_df['road_id'] == road_id]
-            if not road.empty:
-                road = road.iloc[0]
-                t = vehicle['position'] / road['length'] if 'length' in road and road['length'] > 0 else 0.5
-                x = road['start_x'] + t * (road['end_x'] - road['start_x'])
-                y = road['start_y'] + t * (road['end_y'] - road['start_y'])
-                vehicle_positions.append({'vehicle_id': vehicle['vehicle_id'], 'x': x, 'y': y})
-
-        if vehicle_positions:
-            vehicle_positions_df = pd.DataFrame(vehicle_positions)
-            fig.add_trace(go.Scatter(
-                x=vehicle_positions_df['x'],
-                y=vehicle_positions_df['y'],
-                mode='markers',
-                marker=dict(size=10, color='blue', symbol='triangle-up'),
-                name='Vehicles',
-                hovertext=vehicle_positions_df['vehicle_id']
-            ))
+        merged, x, y = compute_vehicle_positions(vehicles, roads_df)
+        if len(merged):
+            x_range, y_range = viewport_bounds(viewport, x, y)
+            trace, visible = create_vehicle_layer(merged['vehicle_id'].to_numpy(), x, y, x_range, y_range)
+            fig.add_trace(trace)
+            if received_at is not None and visible is not None:
+                motion = create_vehicle_motion(merged[visible], len(fig.data) - 1, received_at)
 
     # Finalize the layout of the graph
     fig.update_layout(
-        title='Traffic Simulation Visualization',
+        title=title,
         xaxis_title='X Coordinate',
         yaxis_title='Y Coordinate',
         xaxis=dict(scaleanchor='y', scaleratio=1),
         yaxis=dict(scaleanchor='x', scaleratio=1),
         showlegend=True,
-        margin=dict(l=40, r=40, t=40, b=40)
+        margin=dict(l=40, r=40, t=40, b=40),
+        uirevision='simulation'  # Keep the user's zoom/pan across interval refreshes
     )
 
-    return fig
+    return fig, motion
 
 if __name__ == '__main__':
+    profiler.install_signal_handlers(PROFILING.get('signal_ticks', 10))
+    configUtility.print_startup_report('vizModule')
     app.run_server(debug=True, host='0.0.0.0', port=8050)
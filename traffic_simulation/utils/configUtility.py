@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import types
+import importlib
+import threading
+from contextlib import contextmanager
+
+# config.json next to the modules by default; CONFIG_PATH points elsewhere (e.g. a mounted ConfigMap)
+DEFAULT_CONFIG_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'core', 'config.json'))
+HEAVY_MODULES = ('numpy', 'pandas', 'pyarrow', 'boto3', 'dash', 'plotly')
+
+config = None
+clients = {}
+lock = threading.RLock()
+
+# Startup timings as (name, seconds, depth), in the order they finished
+startup_timings = []
+startup_reported = False
+phase_depth = threading.local()
+
+
+def get_config():
+    """Load config.json once per process and share it between all callers."""
+    global config
+    if config is None:
+        with lock:
+            if config is None:
+                with startup_phase('load config'):
+                    with open(os.environ.get('CONFIG_PATH', DEFAULT_CONFIG_PATH), 'r') as config_file:
+                        config = json.load(config_file)
+    return config
+
+
+def get_client(service, region=None):
+    """
+    Return the process-wide boto3 client for a service, creating it on first use.
+    boto3 itself is only imported then, so modules that never talk to AWS never pay for it.
+    """
+    if region is None:
+        region = get_config().get('aws', {}).get('region')
+    key = (service, region)
+    client = clients.get(key)
+    if client is None:
+        with lock:
+            client = clients.get(key)
+            if client is None:
+                boto3 = import_module('boto3')
+                with startup_phase(f"{service} client"):
+                    client = boto3.client(service, region_name=region) if region else boto3.client(service)
+                clients[key] = client
+    return client
+
+
+class LazyModule(types.ModuleType):
+    """Stand-in for a module that is imported on first attribute access."""
+
+    def __getattr__(self, attr):
+        module = import_module(self.__name__)
+        # Later lookups hit the copied attributes directly and never come back here
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attr)
+
+
+def lazy_import(name):
+    """Return the module if it is already loaded, otherwise a LazyModule for it."""
+    return sys.modules.get(name) or LazyModule(name)
+
+
+def import_module(name):
+    """Import a module, recording the cost in the startup report if it was not loaded yet."""
+    module = sys.modules.get(name)
+    if module is None:
+        with startup_phase(f"import {name}"):
+            module = importlib.import_module(name)
+    return module
+
+
+@contextmanager
+def startup_phase(name):
+    """Time a block of startup work for the startup report."""
+    depth = getattr(phase_depth, 'value', 0)
+    phase_depth.value = depth + 1
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        phase_depth.value = depth
+        seconds = time.perf_counter() - started
+        startup_timings.append((name, seconds, depth))
+        if startup_reported and depth == 0:
+            # Work deferred past startup is reported as it happens
+            print(f"(startup) {name} took {1000 * seconds:.1f} ms")
+
+
+def process_age():
+    """Seconds since this process started, or None where /proc is unavailable."""
+    try:
+        with open('/proc/self/stat', 'r') as f:
+            start_ticks = int(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime', 'r') as f:
+            uptime = float(f.read().split()[0])
+        return uptime - start_ticks / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def print_startup_report(module_name):
+    """Print where startup time went: interpreter and eager imports, then every timed phase."""
+    global startup_reported
+    startup_reported = True
+    total = process_age()
+    timed = sum(seconds for _, seconds, depth in startup_timings if depth == 0)
+
+    lines = [f"({module_name}) Startup report:"]
+    if total is not None:
+        lines.append(f"  {'interpreter and module imports':<40}{1000 * max(total - timed, 0.0):>10.1f} ms")
+    # Nested phases finish before their parent, so list each parent ahead of its children
+    for name, seconds, depth in reorder_phases(startup_timings):
+        lines.append(f"  {'  ' * depth + name:<40}{1000 * seconds:>10.1f} ms")
+    if total is not None:
+        lines.append(f"  {'total since process start':<40}{1000 * total:>10.1f} ms")
+    loaded = [name for name in HEAVY_MODULES if name in sys.modules]
+    deferred = [name for name in HEAVY_MODULES if name not in sys.modules]
+    lines.append(f"  loaded: {', '.join(loaded) or 'none'}; not loaded: {', '.join(deferred) or 'none'}")
+    print('\n'.join(lines))
+
+
+def reorder_phases(timings):
+    ordered = []
+    pending = []  # Children waiting for their parent, innermost last
+    for name, seconds, depth in timings:
+        children = [t for t in pending if t[2] > depth]
+        pending = [t for t in pending if t[2] <= depth]
+        if depth == 0:
+            ordered.append((name, seconds, depth))
+            ordered.extend(children)
+        else:
+            pending.append((name, seconds, depth))
+            pending.extend(children)
+    return ordered + pending
@@ -0,0 +1,156 @@
+import json
+import hashlib
+import numpy as np
+from traffic_simulation.utils import storageUtility
+
+# Which ID namespace keys each category of the SimCore state
+STATE_NAMESPACES = {
+    'intersections': 'intersection',
+    'roads': 'road',
+    'traffic_lights': 'intersection',
+    'road_blockages': 'road',
+    'vehicles': 'vehicle'
+}
+
+
+class IdRegistry:
+    """
+    Dense int32 indices for intersection, road and vehicle IDs.
+
+    Built once from the scenario Parquet files and shared by every module, so
+    messages and in-memory state carry small integers; string IDs are only
+    restored at the edges (state exports, metrics output, the viz). The version
+    is a hash of the ID lists, so modules can tell whether they agree; the
+    sources record the storage versions of the tables it was built from, so a
+    stored registry is rebuilt once the scenario changes.
+    Vehicles spawned at runtime get indices past the scenario's vehicles and
+    derived names (spawned_<index>).
+    """
+
+    NAMESPACES = ('intersection', 'road', 'vehicle')
+
+    def __init__(self, names, sources=None):
+        self.sources = dict(sources or {})
+        self.names = {ns: [str(n) for n in names.get(ns, [])] for ns in self.NAMESPACES}
+        self.indices = {ns: {name: i for i, name in enumerate(self.names[ns])} for ns in self.NAMESPACES}
+        digest = hashlib.sha1(json.dumps(self.names, sort_keys=True).encode('utf-8'))
+        self.version = digest.hexdigest()[:12]
+
+    def count(self, namespace):
+        return len(self.names[namespace])
+
+    def index(self, namespace, name):
+        """Return the index for a string ID, or -1 if it is unknown."""
+        return self.indices[namespace].get(name, -1)
+
+    def encode(self, namespace, names, strict=False):
+        """Vectorized string -> index lookup; unknown IDs map to -1, or raise ValueError if strict."""
+        lookup = self.indices[namespace]
+        indices = np.fromiter((lookup.get(n, -1) for n in names), dtype=np.int32, count=len(names))
+        if strict and (indices < 0).any():
+            unknown = [str(n) for n in names if n not in lookup]
+            raise ValueError(
+                f"ID registry {self.version} has no {namespace} IDs {', '.join(unknown[:5])}"
+                f"{' ...' if len(unknown) > 5 else ''} ({len(unknown)} unknown)"
+            )
+        return indices
+
+    def name(self, namespace, index):
+        """Return the string ID for an index."""
+        if 0 <= index < len(self.names[namespace]):
+            return self.names[namespace][index]
+        if namespace == 'vehicle' and index >= 0:
+            return f"spawned_{index}"
+        return 'unknown'
+
+    def export_state(self, state):
+        """Convert an index-keyed SimCore state into the string-keyed export format."""
+        exported = {}
+        for category, entries in state.items():
+            namespace = STATE_NAMESPACES.get(category)
+            if namespace is None:
+                exported[category] = entries
+                continue
+            names = {}
+            for index, value in entries.items():
+                if category == 'vehicles':
+                    value = dict(value, road=self.name('road', value.get('road', -1)))
+                names[self.name(namespace, index)] = value
+            exported[category] = names
+        return exported
+
+    def to_dict(self):
+        return {'version': self.version, 'sources': self.sources, 'names': self.names}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['names'], data.get('sources'))
+
+
+SOURCE_TABLES = ('intersections', 'roads', 'vehicles', 'traffic_lights', 'road_blockages')
+
+
+def source_versions(storage, s3_links):
+    """Current storage versions of the scenario tables the registry is built from."""
+    return {
+        name: storage.version(storage.key_from_link(s3_links[name]))
+        for name in SOURCE_TABLES if s3_links.get(name)
+    }
+
+
+def build_registry(storage, s3_links, sources=None):
+    """Assign indices from the scenario Parquet files, in file order."""
+    names = {ns: [] for ns in IdRegistry.NAMESPACES}
+    seen = {ns: set() for ns in IdRegistry.NAMESPACES}
+
+    def add(namespace, values):
+        for value in values:
+            value = str(value)
+            if value not in seen[namespace]:
+                seen[namespace].add(value)
+                names[namespace].append(value)
+
+    def read(name):
+        link = s3_links.get(name)
+        return storageUtility.read_parquet(storage, storage.key_from_link(link)) if link else None
+
+    intersections_df = read('intersections')
+    roads_df = read('roads')
+    vehicles_df = read('vehicles')
+    traffic_lights_df = read('traffic_lights')
+    road_blockages_df = read('road_blockages')
+
+    # Primary tables first, then IDs that are only referenced from other tables
+    if intersections_df is not None:
+        add('intersection', intersections_df['intersection_id'])
+    if roads_df is not None:
+        add('road', roads_df['road_id'])
+        add('intersection', roads_df['start'])
+        add('intersection', roads_df['end'])
+    if traffic_lights_df is not None:
+        add('intersection', traffic_lights_df['intersection_id'])
+    if road_blockages_df is not None:
+        add('road', road_blockages_df['road_id'])
+    if vehicles_df is not None:
+        add('vehicle', vehicles_df['vehicle_id'])
+        add('road', vehicles_df['road'])
+
+    return IdRegistry(names, sources)
+
+
+def load_registry(storage, s3_links, registry_key='id_registry.json'):
+    """Load the shared registry from storage, (re)building and storing it when the scenario tables changed."""
+    sources = source_versions(storage, s3_links)
+    try:
+        registry = IdRegistry.from_dict(json.loads(bytes(storage.get(registry_key))))
+        if registry.sources == sources:
+            return registry
+        print(f"Stored ID registry {registry.version} was built from other scenario tables, rebuilding")
+    except Exception:
+        pass
+    # Versions are taken before the tables are read, so a table replaced mid-build triggers another rebuild
+    registry = build_registry(storage, s3_links, sources)
+    # Deterministic, so concurrent builds from the same tables all write the same content
+    storage.put(registry_key, json.dumps(registry.to_dict()))
+    print(f"Built ID registry version {registry.version} ({', '.join(f'{registry.count(ns)} {ns}s' for ns in IdRegistry.NAMESPACES)})")
+    return registry
@@ -0,0 +1,198 @@
+import io
+import sys
+import time
+import signal
+import marshal
+import pstats
+import cProfile
+import threading
+from collections import Counter
+
+PROFILE_MODES = ('deterministic', 'sampling')
+
+
+class TickProfiler:
+    """
+    On-demand profiler for a module's tick handler.
+
+    Started at runtime by a ProfileControl message or a signal (SIGUSR1 for a
+    deterministic cProfile run, SIGUSR2 for stack sampling), it profiles the next
+    N ticks and writes the result to the storage backend under
+    <prefix>/<module>/<timestamp>-<run>-<mode>.*. Callers check `active` before
+    routing a tick through run_tick(), so an idle profiler costs one attribute read.
+    """
+
+    def __init__(self, module_name, storage, prefix='profiles', sample_interval_ms=5):
+        self.module_name = module_name
+        self.storage = storage
+        self.prefix = prefix
+        self.sample_interval = sample_interval_ms / 1000.0
+        self.active = False
+        self.lock = threading.Lock()  # Only one tick may be profiled at a time
+        self.requested = None  # (mode, ticks) set from signal handlers, applied on the next tick
+        self.runs = 0  # Finished profiles, part of the output key
+        self.reset()
+
+    @classmethod
+    def from_config(cls, module_name, storage, profiling):
+        """Build a module's profiler from the PROFILING block of config.json."""
+        return cls(
+            module_name,
+            storage,
+            prefix=profiling.get('prefix', 'profiles'),
+            sample_interval_ms=profiling.get('sample_interval_ms', 5)
+        )
+
+    def reset(self):
+        self.mode = None
+        self.remaining = 0
+        self.profile = None
+        self.samples = None
+        self.tick_times = []
+        self.sampler = None
+        self.sampled_thread = None
+
+    def start(self, ticks, mode='deterministic'):
+        """Profile the next `ticks` ticks."""
+        if mode not in PROFILE_MODES:
+            print(f"({self.module_name}) Unknown profiling mode: {mode}")
+            return
+        with self.lock:
+            if self.active:
+                print(f"({self.module_name}) Profiling already running, ignoring request")
+                return
+            self.mode = mode
+            self.remaining = max(1, int(ticks))
+            if mode == 'deterministic':
+                self.profile = cProfile.Profile()
+            else:
+                self.samples = Counter()
+            self.active = True
+        print(f"({self.module_name}) Profiling the next {self.remaining} ticks ({mode})")
+
+    def request(self, ticks, mode='deterministic'):
+        """Async-signal-safe start: just record the request for the next tick."""
+        self.requested = (mode, ticks)
+        self.active = True
+
+    def handle_control(self, data):
+        """
+        Apply a ProfileControl message if it targets this module, and return
+        whether the caller should delete it.
+
+        Several modules read SimulationEvents, so every message must name its
+        target module: one addressed elsewhere is left on the queue for its
+        target to pick up once it becomes visible again. One without a target,
+        or with invalid ticks or mode, is logged and dropped, so a malformed
+        message can neither stop a module nor keep coming back.
+        """
+        if not isinstance(data, dict) or data.get('module') is None:
+            print(f"({self.module_name}) Dropping ProfileControl without a target module: {data}")
+            return True
+        if data['module'] != self.module_name:
+            return False
+        ticks = data.get('ticks', 10)
+        mode = data.get('mode', 'deterministic')
+        if isinstance(ticks, bool) or not isinstance(ticks, int) or ticks < 1:
+            print(f"({self.module_name}) Dropping ProfileControl with invalid ticks: {ticks!r}")
+            return True
+        if mode not in PROFILE_MODES:
+            print(f"({self.module_name}) Dropping ProfileControl with unknown mode: {mode!r}")
+            return True
+        self.start(ticks, mode)
+        return True
+
+    def install_signal_handlers(self, ticks):
+        """SIGUSR1 starts a deterministic profile, SIGUSR2 a sampling one (main thread only)."""
+        try:
+            signal.signal(signal.SIGUSR1, lambda signum, frame: self.request(ticks, 'deterministic'))
+            signal.signal(signal.SIGUSR2, lambda signum, frame: self.request(ticks, 'sampling'))
+        except (ValueError, AttributeError) as e:
+            print(f"({self.module_name}) Profiling signals unavailable: {e}")
+
+    def run_tick(self, fn, *args, **kwargs):
+        """Run one tick handler under the profiler."""
+        if self.requested is not None and self.mode is None:
+            (mode, ticks), self.requested = self.requested, None
+            self.active = False
+            self.start(ticks, mode)
+        if self.mode is None or not self.lock.acquire(blocking=False):
+            # Another thread is mid-profile (e.g. concurrent Dash callbacks); run this one plainly
+            return fn(*args, **kwargs)
+
+        try:
+            started = time.perf_counter()
+            if self.mode == 'deterministic':
+                self.profile.enable()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.profile.disable()
+            else:
+                self.start_sampler(threading.get_ident())
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.stop_sampler()
+        finally:
+            self.tick_times.append(time.perf_counter() - started)
+            self.remaining -= 1
+            if self.remaining <= 0:
+                self.finish()
+            self.lock.release()
+
+    def start_sampler(self, thread_id):
+        self.sampled_thread = thread_id
+        self.sampler = threading.Thread(target=self.sample_loop, name=f"{self.module_name}Sampler", daemon=True)
+        self.sampler.start()
+
+    def stop_sampler(self):
+        self.sampled_thread = None
+        self.sampler.join()
+
+    def sample_loop(self):
+        # Collect collapsed stacks (flamegraph "folded" format) of the tick thread
+        while self.sampled_thread is not None:
+            frame = sys._current_frames().get(self.sampled_thread)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_filename.rsplit('/', 1)[-1]}:{code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[';'.join(reversed(stack))] += 1
+            time.sleep(self.sample_interval)
+
+    def finish(self):
+        """Write the collected profile to storage and switch profiling off, unless another run is pending."""
+        now = time.time()
+        self.runs += 1
+        # Millisecond timestamp plus run counter, so back-to-back runs never overwrite each other
+        stamp = f"{time.strftime('%Y%m%dT%H%M%S', time.localtime(now))}.{int(now * 1000) % 1000:03d}"
+        key = f"{self.prefix}/{self.module_name}/{stamp}-{self.runs}-{self.mode}"
+        tick_times = self.tick_times
+        header = (
+            f"{self.module_name}: {len(tick_times)} ticks profiled ({self.mode}), "
+            f"mean {1000 * sum(tick_times) / len(tick_times):.2f} ms, max {1000 * max(tick_times):.2f} ms per tick\n\n"
+        )
+        try:
+            if self.mode == 'deterministic':
+                # Raw stats are loadable with pstats/snakeviz; the text report lists the hot path
+                self.profile.create_stats()
+                self.storage.put(f"{key}.prof", marshal.dumps(self.profile.stats))
+                report = io.StringIO()
+                pstats.Stats(self.profile, stream=report).sort_stats('cumulative').print_stats(40)
+                self.storage.put(f"{key}.txt", header + report.getvalue())
+            else:
+                folded = ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+                self.storage.put(f"{key}.folded", folded)
+                self.storage.put(f"{key}.txt", header + f"{sum(self.samples.values())} samples every {self.sample_interval * 1000:g} ms\n")
+            print(f"({self.module_name}) Profile written to {key}")
+        except Exception as e:
+            print(f"({self.module_name}) Error writing profile: {e}")
+        finally:
+            self.reset()
+            self.active = False
+            # A signal that arrived mid-run left its request behind; keep run_tick() picking it up
+            if self.requested is not None:
+                self.active = True
@@ -1,27 +1,18 @@
-import os
-import boto3
 import json
 import logging
 import uuid
+from traffic_simulation.utils import configUtility
 
 # Set up logging
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
 
-# Load configuration from config.json
-config_file = os.path.join(os.path.dirname(__file__), '..', 'core', 'config.json')  # relative path D:
-with open(config_file, 'r') as config_file:
-    CONFIG = json.load(config_file)
-    AWS_REGION = CONFIG['aws']['region']
-    MAX_NUMBER_OF_MESSAGES = CONFIG.get('MAX_NUMBER_OF_MESSAGES', 10)
-    WAIT_TIME_SECONDS = CONFIG.get('WAIT_TIME_SECONDS', 1)
-
-# AWS Configuration
-try:
-    sqs_client = boto3.client('sqs', region_name=AWS_REGION)
-    logging.info(f"SQS client created for region {AWS_REGION}")
-except Exception as e:
-    logging.error(f"Error creating SQS client: {str(e)}")
-    raise
+def get_sqs_client():
+    """Shared SQS client, created (and boto3 imported) on first use."""
+    try:
+        return configUtility.get_client('sqs', configUtility.get_config()['aws']['region'])
+    except Exception as e:
+        logging.error(f"Error creating SQS client: {str(e)}")
+        raise
 
 # Dictionary to store queue URLs
 queue_urls_cache = {}
@@ -36,8 +27,10 @@ def get_queue_urls(queue_names):
         if queue_name in queue_urls_cache:
             urls[queue_name] = queue_urls_cache[queue_name]
         else:
+            sqs_client = get_sqs_client()
             try:
-                response = sqs_client.get_queue_url(QueueName=queue_name)
+                with configUtility.startup_phase(f"queue URL {queue_name}"):
+                    response = sqs_client.get_queue_url(QueueName=queue_name)
                 queue_url = response['QueueUrl']
                 queue_urls_cache[queue_name] = queue_url
                 urls[queue_name] = queue_url
@@ -66,7 +59,7 @@ def send_message(queue_url, message, message_group_id=None):
             params['MessageGroupId'] = message_group_id
             params['MessageDeduplicationId'] = str(uuid.uuid4())
 
-        response = sqs_client.send_message(**params)
+        response = get_sqs_client().send_message(**params)
         logging.info(f"Message sent to queue {queue_url}: {message_body}")
         return response
     except Exception as e:
@@ -94,7 +87,7 @@ def send_batch_messages(queue_url, messages, message_group_id=None):
     for i in range(0, len(entries), 10):
         batch_entries = entries[i:i+10]
         try:
-            response = sqs_client.send_message_batch(
+            response = get_sqs_client().send_message_batch(
                 QueueUrl=queue_url,
                 Entries=batch_entries
             )
@@ -105,13 +98,18 @@ def send_batch_messages(queue_url, messages, message_group_id=None):
             raise
     return responses
 
-def receive_messages(queue_url, max_number_of_messages=MAX_NUMBER_OF_MESSAGES, wait_time_seconds=WAIT_TIME_SECONDS):
+def receive_messages(queue_url, max_number_of_messages=None, wait_time_seconds=None):
     """
     Receive messages from an SQS queue.
+    Limits default to MAX_NUMBER_OF_MESSAGES and WAIT_TIME_SECONDS from config.json.
     Returns a list of messages.
     """
+    if max_number_of_messages is None:
+        max_number_of_messages = configUtility.get_config().get('MAX_NUMBER_OF_MESSAGES', 10)
+    if wait_time_seconds is None:
+        wait_time_seconds = configUtility.get_config().get('WAIT_TIME_SECONDS', 1)
     try:
-        response = sqs_client.receive_message(
+        response = get_sqs_client().receive_message(
             QueueUrl=queue_url,
             MaxNumberOfMessages=max_number_of_messages,
             WaitTimeSeconds=wait_time_seconds,
@@ -130,7 +128,7 @@ def delete_message(queue_url, receipt_handle):
     Delete a message from an SQS queue using the receipt handle.
     """
     try:
-        sqs_client.delete_message(
+        get_sqs_client().delete_message(
             QueueUrl=queue_url,
             ReceiptHandle=receipt_handle
         )
@@ -0,0 +1,260 @@
+import os
+import io
+import json
+import mmap
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from traffic_simulation.utils import configUtility
+
+# Imported on first use; modules that never touch Parquet skip the pyarrow import
+pa = configUtility.lazy_import('pyarrow')
+pq = configUtility.lazy_import('pyarrow.parquet')
+
+
+class StorageBackend(ABC):
+    """
+    Minimal object store interface shared by all modules.
+
+    Keys are '/'-separated paths relative to the backend root (bucket or directory).
+    Versions are opaque strings; get_if_changed() uses them to skip unchanged objects.
+    """
+
+    @abstractmethod
+    def get(self, key):
+        """Return the object's bytes (or a read-only bytes-like buffer)."""
+
+    @abstractmethod
+    def get_if_changed(self, key, version=None):
+        """Return (data, version), or (None, version) when the stored version matches."""
+
+    @abstractmethod
+    def version(self, key):
+        """Return the object's current version without reading it, or None if it does not exist."""
+
+    @abstractmethod
+    def put(self, key, data):
+        """Store bytes under key and return the new version."""
+
+    @abstractmethod
+    def list(self, prefix=''):
+        """Return the sorted keys starting with prefix."""
+
+    def key_from_link(self, link):
+        """Map an S3_LINKS entry (s3://bucket/key) to a key on this backend, relative to its root."""
+        if link.startswith('s3://'):
+            return link[len('s3://'):].split('/', 1)[1]
+        return link
+
+
+class S3Storage(StorageBackend):
+    """
+    S3 backend. Keys are relative to the configured bucket, except full
+    s3://bucket/key links, which are read from the bucket they name.
+    """
+
+    def __init__(self, bucket, region=None):
+        self.bucket = bucket
+        self.region = region
+
+    @property
+    def s3_client(self):
+        # Shared client, created on the first request rather than at startup
+        return configUtility.get_client('s3', self.region)
+
+    def key_from_link(self, link):
+        return link  # Kept whole, so the link's own bucket is honoured
+
+    def _locate(self, key):
+        if key.startswith('s3://'):
+            bucket, key = key[len('s3://'):].split('/', 1)
+            return bucket, key
+        return self.bucket, key
+
+    def get(self, key):
+        bucket, key = self._locate(key)
+        response = self.s3_client.get_object(Bucket=bucket, Key=key)
+        return response['Body'].read()
+
+    def get_if_changed(self, key, version=None):
+        bucket, key = self._locate(key)
+        params = {'Bucket': bucket, 'Key': key}
+        if version:
+            params['IfNoneMatch'] = version
+        try:
+            response = self.s3_client.get_object(**params)
+        except configUtility.import_module('botocore.exceptions').ClientError as e:
+            # S3 answers 304 Not Modified when the ETag still matches
+            if e.response.get('Error', {}).get('Code') in ('304', 'NotModified'):
+                return None, version
+            raise
+        return response['Body'].read(), response['ETag']
+
+    def version(self, key):
+        bucket, key = self._locate(key)
+        try:
+            return self.s3_client.head_object(Bucket=bucket, Key=key)['ETag']
+        except configUtility.import_module('botocore.exceptions').ClientError as e:
+            if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+                return None
+            raise
+
+    def put(self, key, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        bucket, key = self._locate(key)
+        response = self.s3_client.put_object(Bucket=bucket, Key=key, Body=data)
+        return response['ETag']
+
+    def list(self, prefix=''):
+        keys = []
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=prefix):
+            keys.extend(obj['Key'] for obj in page.get('Contents', []))
+        return sorted(keys)
+
+
+class LocalStorage(StorageBackend):
+    """
+    Filesystem backend for co-located modules sharing a volume.
+    Writes go to a temporary file and are renamed into place, so readers never
+    see a partial object; reads are memory-mapped instead of copied into memory.
+    """
+
+    def __init__(self, root):
+        self.root = root
+        os.makedirs(self.root, exist_ok=True)
+        # mkstemp creates files as 0600; give renamed objects the mode a plain open() would
+        umask = os.umask(0)
+        os.umask(umask)
+        self.file_mode = 0o666 & ~umask
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split('/'))
+
+    def _version(self, path):
+        stat = os.stat(path)
+        return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+    def _map(self, path):
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return b''  # mmap cannot map empty files
+            # The mapping stays valid after the file is closed (and after a later rename replaces it)
+            return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def get(self, key):
+        return self._map(self._path(key))
+
+    def get_if_changed(self, key, version=None):
+        path = self._path(key)
+        current = self._version(path)
+        if version == current:
+            return None, version
+        return self._map(path), current
+
+    def version(self, key):
+        path = self._path(key)
+        return self._version(path) if os.path.exists(path) else None
+
+    def put(self, key, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        path = self._path(key)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(data)
+                os.fchmod(f.fileno(), self.file_mode)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+        return self._version(path)
+
+    def list(self, prefix=''):
+        keys = []
+        for directory, _, files in os.walk(self.root):
+            for name in files:
+                if name.startswith('.tmp-'):
+                    continue
+                key = os.path.relpath(os.path.join(directory, name), self.root).replace(os.sep, '/')
+                if key.startswith(prefix):
+                    keys.append(key)
+        return sorted(keys)
+
+
+class MemoryStorage(StorageBackend):
+    """In-process backend for tests and single-process runs."""
+
+    def __init__(self):
+        self.objects = {}  # key -> (data, version)
+        self.counter = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        return self.objects[key][0]
+
+    def get_if_changed(self, key, version=None):
+        data, current = self.objects[key]
+        if version == current:
+            return None, version
+        return data, current
+
+    def version(self, key):
+        entry = self.objects.get(key)
+        return entry[1] if entry else None
+
+    def put(self, key, data):
+        if isinstance(data, str):
+            data = data.encode('utf-8')
+        with self.lock:
+            self.counter += 1
+            version = str(self.counter)
+            self.objects[key] = (bytes(data), version)
+        return version
+
+    def list(self, prefix=''):
+        return sorted(key for key in self.objects if key.startswith(prefix))
+
+
+def get_storage(config):
+    """
+    Build the storage backend selected in config.json, e.g.
+    "STORAGE": {"backend": "local", "root": "/data/trafficsimulation"}.
+    Defaults to S3 on S3_BUCKET.
+    """
+    storage_config = config.get('STORAGE', {})
+    backend = storage_config.get('backend', 's3')
+    if backend == 's3':
+        region = config.get('aws', {}).get('region')
+        return S3Storage(storage_config.get('bucket', config.get('S3_BUCKET')), region)
+    elif backend == 'local':
+        return LocalStorage(storage_config.get('root', 'storage'))
+    elif backend == 'memory':
+        return MemoryStorage()
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+
+def read_parquet(storage, key):
+    """Load a Parquet object into a DataFrame straight from the backend's buffer."""
+    buffer = pa.py_buffer(storage.get(key))  # Zero-copy view over bytes or an mmap
+    return pq.read_table(pa.BufferReader(buffer)).to_pandas()
+
+
+def write_parquet(storage, key, df):
+    """Serialize a DataFrame to Parquet and store it under key."""
+    sink = io.BytesIO()
+    df.to_parquet(sink, index=False)
+    return storage.put(key, sink.getvalue())
+
+
+def read_json(storage, key, version=None):
+    """Conditional JSON read: returns (obj, version), or (None, version) if unchanged."""
+    data, version = storage.get_if_changed(key, version)
+    if data is None:
+        return None, version
+    return json.loads(bytes(data)), version